@@ -4,7 +4,8 @@
 import os, sys
 import argparse
 from datetime import datetime
-import re
+
+from drone_video import build_preprocess_plan, print_preprocess_plan, apply_preprocess_plan
 
 
 def parse_args():
@@ -16,86 +17,35 @@ def parse_args():
 
     parser.add_argument('--delete-ext', type=list_of_strings, default='LRV,THM', help="LRV,THM")
     parser.add_argument('--valid-ext', type=list_of_strings, default='MP4', help="MP4,AVI")
+    parser.add_argument('--companion-ext', type=list_of_strings, default='LRV,THM', help="Files renamed with their video when they are not deleted (--delete-ext THM keeps the LRV proxies for the preview)")
 
     parser.add_argument('--suffix', type=str, default='', help="Suffix to be added in file name. Ex: _height=9m")
     parser.add_argument('-f', '--force', action='store_true', help="Force renaming files, even if they are already formatted")
+    parser.add_argument('--dry-run', action='store_true', help="Only print the files that would be deleted and renamed")
+    parser.add_argument('--threads', type=int, default=8, help="Threads deleting and renaming files (useful on network filesystems)")
     
     args = parser.parse_args()
     return args
 
 
-def find_files_with_extensions(folder_path, valid_extensions):
-    valid_extensions = [ext.lower() for ext in valid_extensions]
-    matching_files = []
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if any(file.lower().endswith(ext) for ext in valid_extensions):
-                matching_files.append(os.path.join(root, file))
-    
-    return sorted(matching_files)
-
-
-def timeConvert(timestamp):
-    newtime = datetime.fromtimestamp(timestamp)
-    date_str = str(newtime.date())
-    time_str = str(newtime.time()).split('.')[0].replace(':','-')
-    return date_str, time_str
-
-
-def filename_is_already_formatted(pathfile, suffix=''):
-    filename = os.path.basename(pathfile)
-    pattern = r'\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}.'+suffix
-    # print('pattern:', pattern)
-    return bool(re.search(pattern, filename))
-
-
-
 def main():
     args = parse_args()
     args.suffix = args.suffix.strip('_')
-    # print('args.valid_ext:', args.valid_ext, 'type:', type(args.valid_ext), 'tuple:', tuple(args.valid_ext))
-    # print('args.delete_ext:', args.delete_ext, 'type:', type(args.delete_ext), 'tuple:', tuple(args.delete_ext))
-    # sys.exit(0)
 
     # Check directories
     if not os.path.exists(args.input_folder):
         raise Exception('No such directory:', args.input_folder)
-    
-    # Delete unnecessary files
-    pathfiles_to_delete = find_files_with_extensions(args.input_folder, args.delete_ext)
-    if len(pathfiles_to_delete) > 0:
-        for idx_file, path_file in enumerate(pathfiles_to_delete):
-            if path_file.endswith(tuple(args.delete_ext)) and not path_file.endswith(tuple(args.valid_ext)):
-                print(f'DELETING FILE {idx_file}/{len(pathfiles_to_delete)}: {path_file}', end='\r')
-                os.remove(path_file)
-        print('')
-    else:
-        print(f'{len(pathfiles_to_delete)} files deleted, {len(pathfiles_to_delete)} files {args.delete_ext} found in \'{args.input_folder}\'')
 
-    # Rename video files
-    pathfiles_valid = find_files_with_extensions(args.input_folder, args.valid_ext)
-    pathfiles_valid_to_rename = [filename for filename in pathfiles_valid
-                                 if (not filename_is_already_formatted(filename, args.suffix) or args.force)]
-    if len(pathfiles_valid_to_rename) > 0:
-        for idx_pathfile_valid_rename, pathfile_valid_rename in enumerate(pathfiles_valid_to_rename):
-            stat_orig_video = os.stat(pathfile_valid_rename)
-            mdate_str, mtime_str = timeConvert(stat_orig_video.st_mtime)
-            print(f'RENAMING FILE {idx_pathfile_valid_rename}/{len(pathfiles_valid_to_rename)}: {pathfile_valid_rename}')
+    plan = build_preprocess_plan(args.input_folder, args.delete_ext, args.valid_ext, args.suffix, args.force, args.companion_ext)
+    if args.dry_run:
+        print_preprocess_plan(plan)
+        return
 
-            # build new file name
-            pathfile_valid_rename_path, pathfile_valid_rename_filename = os.path.dirname(pathfile_valid_rename), os.path.basename(pathfile_valid_rename)
-            pathfile_valid_rename_name, pathfile_valid_rename_extension = os.path.splitext(pathfile_valid_rename_filename)
-            pathfile_valid_rename_newname = pathfile_valid_rename_name.split('_')[0] \
-                                                      + '_' + mdate_str \
-                                                      + '_' + mtime_str \
-                                                      + ('_' + args.suffix if args.suffix != '' else '') \
-                                                      + pathfile_valid_rename_extension
-            pathfile_valid_rename_newpath = os.path.join(pathfile_valid_rename_path, pathfile_valid_rename_newname)
-            print(f'              └─> {pathfile_valid_rename_newname}')
-            os.rename(pathfile_valid_rename, pathfile_valid_rename_newpath)
-        print('')
-    else:
-        print(f'{len(pathfiles_valid_to_rename)} files renamed, {len(pathfiles_valid)} files', args.valid_ext, f'with names already formatted in \'{args.input_folder}\'')
+    apply_preprocess_plan(plan, args.threads)
+    print(f"{len(plan['delete'])} files deleted, {args.delete_ext} files found in '{args.input_folder}'")
+    print(f"{len(plan['rename'])} files renamed, {plan['num_valid'] - plan['num_valid_renamed']} files {args.valid_ext} with names already formatted in '{args.input_folder}'")
+    for path_file, new_path in plan['collisions']:
+        print(f'    Not renamed, {os.path.basename(new_path)} already exists or is the new name of another file: {path_file}')
 
 
 
@@ -4,164 +4,99 @@
 
 import os, sys
 import cv2
-import argparse
 import time
-from datetime import datetime
-import re
 import threading
-
-
-def parse_args():
-    def list_of_strings(arg):
-        return arg.split(',')
-
-    parser = argparse.ArgumentParser(description="Extract frames from videos")
-    parser.add_argument('--input', type=str, required=True, help="Folder containing video files to preprocess")
-    parser.add_argument('--frame-folder', type=str, required=True, help="Folder to save extracted frames")
-    
-    parser.add_argument('--valid-ext', type=list_of_strings, default='MP4', help="MP4,AVI")
-    parser.add_argument('--frame-ext', type=list_of_strings, default='png,jpg', help="png,jpg")
-    parser.add_argument('--frame-quality', type=list_of_strings, default='95', help="90,95")  # ignored if --frame-ext=png'
-    
-    parser.add_argument('--all', action='store_true', help="Extract all frames from video")
-    parser.add_argument('-f', '--force', action='store_true', help="Force renaming files, even if they are already formatted")
-    
-    args = parser.parse_args()
-    return args
-
-
-def find_files_with_extensions(folder_path, valid_extensions):
-    valid_extensions = [ext.lower() for ext in valid_extensions]
-    matching_files = []
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if any(file.lower().endswith(ext) for ext in valid_extensions):
-                matching_files.append(os.path.join(root, file))
-    
-    return sorted(matching_files)
-
-
-def count_num_frames_video(video_path, verbose=False):
-    cap = cv2.VideoCapture(video_path)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    try:
-        if verbose: print(f'    Counting num frames video: ', end='')
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        if verbose: print(f'{frame_count} - {width}x{height} - fps: {fps}')
-    except:
-        frame_count = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            frame_count += 1
-            if verbose:
-                print(f'    Counting num frames video: {frame_count}', end='\r')
-        if verbose: print(f' - {width}x{height} - fps: {fps}')
-    return frame_count, width, height, fps
-
-
-def save_frame(frame_path, frame, frame_quality=95):
-    if frame_path.endswith('jpg'):
-        cv2.imwrite(frame_path, frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(frame_quality)])
-    else:
-        cv2.imwrite(frame_path, frame)
-
-
-def clear_terminal_line():
-    sys.stdout.write('\x1b[2K')
-
-
-def extract_all_frames_from_video(video_path='', frames_path='', frame_exts=['png','jpg'], frame_quality=95):
-    frame_exts = [ext.lower().strip('.') for ext in frame_exts]
-    
+import concurrent.futures
+
+from drone_video import (count_num_frames_video, PreviewFrames, find_files_with_extensions, start_monitoring_cv2_window,
+                         check_frame_transform, get_frame_outputs, get_frame_paths, encode_frame_outputs, parse_extract_args, get_extraction_kwargs,
+                         get_selection_path, load_selection, save_selection, clear_terminal_line, MetricsWriter,
+                         print_throughput_summary, extract_all_frames_from_video, extract_videos_parallel, plan_cpu_budget)
+
+
+class FrameSaver:
+    # Saves the frames selected in manual mode in background threads, so the playback doesn't freeze while
+    # the PNG/JPEG files are encoded. At most `max_pending` frames wait in memory, save() blocks beyond that.
+    # The frames are encoded for the same outputs (encoder options, crop and sizes) as in the bulk extraction.
+    def __init__(self, frame_outputs, num_threads=2, max_pending=8):
+        self.frame_outputs = frame_outputs
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, num_threads))
+        self.slots = threading.BoundedSemaphore(max(1, max_pending))
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.errors = []
+
+    def save(self, frame, frame_paths):
+        # frame_paths: (path, quality) of every output of the frame, from get_frame_paths()
+        self.slots.acquire()
+        with self.lock:
+            self.pending += 1
+        self.executor.submit(self.save_frame_files, frame, frame_paths)
+
+    def save_frame_files(self, frame, frame_paths):
+        try:
+            for (frame_path, frame_qual), encoded in zip(frame_paths, encode_frame_outputs(frame, self.frame_outputs)[0]):
+                with open(frame_path, 'wb') as frame_file:
+                    frame_file.write(encoded)
+        except Exception as error:
+            self.errors.append(f'Error: Unable to save frame: {error}')
+        finally:
+            with self.lock:
+                self.pending -= 1
+            self.slots.release()
+
+    def close(self):
+        # waits for the frames still being saved
+        if self.pending > 0:
+            print(f"\n    Waiting for {self.pending} frames being saved...")
+        self.executor.shutdown(wait=True)
+        for error in self.errors:
+            print(f'    {error}')
+
+
+def manually_extract_frames_from_video(video_path='', frames_path='', frame_exts=['png','jpg'], frame_quality=95, cache_mb=512, read_ahead=16, preview='off', preview_width=1280,
+                                       save_threads=2, max_pending_saves=8, encoder_options=None, frame_transform=None):
     if not type(frame_quality) is list:
         frame_quality = [frame_quality]
-    frame_quality = [int(frame_qual) for frame_qual in frame_quality]
-
-    num_frames_video = count_num_frames_video(video_path, verbose=True)
-    cap = cv2.VideoCapture(video_path)
-    idx_frame = 0
-
-    # Get video properties
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    video_name, video_ext = os.path.splitext(os.path.basename(video_path))
-
-    print(f"    Processing {video_name} ({width}x{height}, {fps} FPS)...")
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        for frame_ext in frame_exts:
-            frame_filename = f"{video_name}_frame_{idx_frame:06d}.{frame_ext}"
-            frame_path = os.path.join(frames_path, frame_filename)
-
-            if frame_path.endswith('jpg'):
-                for frame_qual in frame_quality:
-                    frame_dir_jpg = os.path.dirname(frame_path)
-                    frame_name_jpg, frame_ext_jpg = os.path.splitext(frame_filename)
-                    frame_name_jpg += f'_JPEG_QUALITY={frame_qual}'
-                    frame_path = os.path.join(frame_dir_jpg, f'{frame_name_jpg}{frame_ext_jpg}')
-                    clear_terminal_line()
-                    print(f"\r    Saving frame {idx_frame}/{num_frames_video}: {frame_path}", end='\r')
-                    save_frame(frame_path, frame, frame_qual)
-            else:
-                clear_terminal_line()
-                print(f"\r    Saving frame {idx_frame}/{num_frames_video}: {frame_path}", end='\r')
-                save_frame(frame_path, frame)
-
-        idx_frame += 1
-
-    cap.release()
-    print(f"Extracted {idx_frame} frames from {video_name}.")
-
-
-
-def start_monitoring_cv2_window(window_name=''):
-        def check_window_is_open():
-            while True:
-                if cv2.getWindowProperty(window_name, 0) >= 0:
-                    if not cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE):   # windows is open
-                        print("\nWindow closed")
-                        os._exit(0)
-                time.sleep(0.5)
-
-        thread = threading.Thread(target=check_window_is_open)
-        thread.start()
-
-def manually_extract_frames_from_video(video_path='', frames_path='', frame_exts=['png','jpg'], frame_quality=95):
+    frame_outputs = get_frame_outputs([ext.lower().strip('.') for ext in frame_exts], [int(frame_qual) for frame_qual in frame_quality],
+                                      encoder_options, frame_transform)
     print(f'Opening video: \'{video_path}\'')
-    total_frames, width, height, fps = count_num_frames_video(video_path, verbose=True)
+    frame_cache = PreviewFrames(video_path, preview, preview_width, cache_mb, read_ahead)
+    total_frames, width, height, fps = count_num_frames_video(video_path, verbose=True)   # read by the frame cache, not probed again
+    try:
+        check_frame_transform(frame_transform, width, height)
+    except Exception:
+        frame_cache.close()
+        raise
+    frame_saver = FrameSaver(frame_outputs, save_threads, max_pending_saves)
     delay_frame = int(1000.0/fps)
-    cap = cv2.VideoCapture(video_path)
 
-    print(f'    ESC/q: quit    SPACEBAR: pause/play    ←/a: previous frame    →/d: next frame    s: save frame')
+    # frames and ranges marked with m and r, extracted later with --from-selection
+    selection = load_selection(video_path) or {'video': os.path.basename(video_path), 'frames': [], 'ranges': []}
+    range_start = None
+
+    def exit_player():
+        # never exit with frames still being saved
+        frame_saver.close()
+        os._exit(0)
+
+    print(f'    ESC/q: quit    SPACEBAR: pause/play    ←/a: previous frame    →/d: next frame    s: save frame    m: mark/unmark frame    r: start/end range')
     window_name = os.path.basename(video_path)
     cv2.namedWindow(window_name, cv2.WINDOW_KEEPRATIO)
     cv2.resizeWindow(window_name, 1024, 680)
-    start_monitoring_cv2_window(window_name)
-
-    if not cap.isOpened():
-        Exception(f"Error: Unable to open video file: {video_path}")
-        return
+    start_monitoring_cv2_window(window_name, on_close=frame_saver.close)
 
     playing = True
     frame_idx = 0
     key = -1
 
     # main loop
-    while cap.isOpened():
+    while True:
         if cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) >= 1:   # windows is open
-            print(f'    {window_name} - frame {frame_idx}/{total_frames} - key: {key}    ', end='\r')
+            print(f'    {window_name} - frame {frame_idx}/{total_frames} - key: {key} - pending saves: {frame_saver.pending} - selected: {len(selection["frames"])} frames {len(selection["ranges"])} ranges    ', end='\r')
             if playing:
-                ret, frame = cap.read()
-                if not ret:
+                frame = frame_cache.get(frame_idx)
+                if frame is None:
                     print("\nEnd of video reached or error reading video")
                     break
                 
@@ -172,7 +107,7 @@ def manually_extract_frames_from_video(video_path='', frames_path='', frame_exts
 
             if key == 27 or key == ord('q'):  # ESC or 'q' key to exit
                 print("\nExiting video player")
-                os._exit(0)
+                exit_player()
             
             if key == ord(' '):  # Space key to pause/play
                 playing = not playing
@@ -180,58 +115,66 @@ def manually_extract_frames_from_video(video_path='', frames_path='', frame_exts
             if key == 81 or key == ord('a'):  # Left arrow key to move backward one frame
                 playing = False
                 frame_idx = max(0, frame_idx-1)
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-                ret, frame = cap.read()
-                if ret:
+                frame = frame_cache.get(frame_idx)
+                if frame is not None:
                     cv2.imshow(window_name, frame)
 
             if key == 83 or key == ord('d'):  # Right arrow key to move forward one frame
                 playing = False
                 frame_idx = min(total_frames-1, frame_idx+1)
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-                ret, frame = cap.read()
-                if ret:
+                frame = frame_cache.get(frame_idx)
+                if frame is not None:
                     cv2.imshow(window_name, frame)
             
             if key == ord('s'):  # Save frame
                 video_name, video_ext = os.path.splitext(os.path.basename(video_path))
-                for frame_ext in frame_exts:
-                    frame_filename = f"{video_name}_frame_{frame_idx:06d}.{frame_ext}"
-                    frame_path = os.path.join(frames_path, frame_filename)
-
-                    if frame_path.endswith('jpg'):
-                        for frame_qual in frame_quality:
-                            frame_dir_jpg = os.path.dirname(frame_path)
-                            frame_name_jpg, frame_ext_jpg = os.path.splitext(frame_filename)
-                            frame_name_jpg += f'_JPEG_QUALITY={frame_qual}'
-                            frame_path = os.path.join(frame_dir_jpg, f'{frame_name_jpg}{frame_ext_jpg}')
-                            clear_terminal_line()
-                            print(f"    Saving frame {frame_idx}/{total_frames}: {frame_path}")
-                            save_frame(frame_path, frame, frame_qual)
-                    else:
-                        clear_terminal_line()
-                        print(f"    Saving frame {frame_idx}/{total_frames}: {frame_path}")
-                        save_frame(frame_path, frame)
+                frame = frame_cache.get_full(frame_idx)   # full resolution, even when previewing a proxy
+                frame_paths = get_frame_paths(frames_path, video_name, frame_idx, frame_outputs)
+                for frame_path, frame_qual in frame_paths:
+                    clear_terminal_line()
+                    print(f"    Saving frame {frame_idx}/{total_frames}: {frame_path}")
+                frame_saver.save(frame, frame_paths)
+
+            if key == ord('m'):  # Mark frame in the selection file
+                if frame_idx in selection['frames']:
+                    selection['frames'].remove(frame_idx)
+                else:
+                    selection['frames'] = sorted(selection['frames'] + [frame_idx])
+                save_selection(video_path, selection)
+                clear_terminal_line()
+                print(f"    {'Marked' if frame_idx in selection['frames'] else 'Unmarked'} frame {frame_idx}/{total_frames}: {get_selection_path(video_path)}")
+
+            if key == ord('r'):  # Start or end a range of frames in the selection file
+                clear_terminal_line()
+                if range_start is None:
+                    range_start = frame_idx
+                    print(f"    Range started at frame {frame_idx}/{total_frames}, press r again to end it")
+                else:
+                    selection['ranges'].append([min(range_start, frame_idx), max(range_start, frame_idx)])
+                    save_selection(video_path, selection)
+                    print(f"    Marked frames {min(range_start, frame_idx)}-{max(range_start, frame_idx)}: {get_selection_path(video_path)}")
+                    range_start = None
 
             if playing:
                 frame_idx += 1
 
         else:
             print("\nWindow closed")
-            os._exit(0)
+            exit_player()
 
-    os._exit(0)
-    cap.release()
+    frame_cache.close()
     cv2.destroyAllWindows()
-
+    exit_player()
 
 
 def main():
-    args = parse_args()
+    args = parse_extract_args()
     
     # Check directories
     if not os.path.exists(args.input):
         raise Exception(f'No such file or directory: {args.input}')
+    metrics_writer = MetricsWriter(args.metrics_file) if args.metrics_file and args.all else None
+    extraction_kwargs = get_extraction_kwargs(args)
 
 
     if os.path.isfile(args.input):
@@ -240,10 +183,15 @@ def main():
         os.makedirs(frame_video_folder, exist_ok=True)
 
         if args.all:
-            extract_all_frames_from_video(args.input, frame_video_folder, args.frame_ext, args.frame_quality)
+            stats = extract_all_frames_from_video(args.input, frame_video_folder, **extraction_kwargs)
+            if metrics_writer is not None:
+                metrics_writer.add_video(stats)
+                metrics_writer.finish(stats['seconds'])
         else:
             # show frames in screen for manual selection before saving them
-            manually_extract_frames_from_video(args.input, frame_video_folder, args.frame_ext, args.frame_quality)
+            manually_extract_frames_from_video(args.input, frame_video_folder, args.frame_ext, args.frame_quality, args.cache_mb, args.read_ahead,
+                                               args.preview, args.preview_width, args.save_threads, args.max_pending_saves,
+                                               extraction_kwargs['encoder_options'], extraction_kwargs['frame_transform'])
 
 
     elif os.path.isdir(args.input):
@@ -253,7 +201,18 @@ def main():
 
         # Find video files
         paths_videos = find_files_with_extensions(args.input, args.valid_ext)
-        if len(paths_videos) > 0:
+        if len(paths_videos) > 0 and args.all and args.jobs != 1:
+            num_jobs, args.workers = plan_cpu_budget(len(paths_videos), args.jobs, args.workers, args.cpus)
+            args.max_memory /= num_jobs
+            print(f'Extracting {len(paths_videos)} videos, {num_jobs} at once with {args.workers} workers each')
+            start_time = time.time()
+            all_stats = extract_videos_parallel(paths_videos, args.frame_folder, get_extraction_kwargs(args), num_jobs, metrics_writer)
+            print_throughput_summary(all_stats, time.time() - start_time)
+            if metrics_writer is not None:
+                metrics_writer.finish(time.time() - start_time)
+        elif len(paths_videos) > 0:
+            start_time = time.time()
+            all_stats = []
             for idx_video, path_video in enumerate(paths_videos):
                 print(f'VIDEO {idx_video}/{len(paths_videos)}: {path_video}')
                 
@@ -262,10 +221,18 @@ def main():
                 os.makedirs(frame_video_folder, exist_ok=True)
 
                 if args.all:
-                    extract_all_frames_from_video(path_video, frame_video_folder, args.frame_ext, args.frame_quality)
+                    all_stats.append(extract_all_frames_from_video(path_video, frame_video_folder, **extraction_kwargs))
+                    if metrics_writer is not None:
+                        metrics_writer.add_video(all_stats[-1])
                 else:
                     # show frames in screen for manual selection before saving them
-                    manually_extract_frames_from_video(path_video, frame_video_folder, args.frame_ext, args.frame_quality)
+                    manually_extract_frames_from_video(path_video, frame_video_folder, args.frame_ext, args.frame_quality, args.cache_mb, args.read_ahead,
+                                                       args.preview, args.preview_width, args.save_threads, args.max_pending_saves,
+                                                       extraction_kwargs['encoder_options'], extraction_kwargs['frame_transform'])
+            if args.all:
+                print_throughput_summary(all_stats, time.time() - start_time)
+                if metrics_writer is not None:
+                    metrics_writer.finish(time.time() - start_time)
         else:
             print(f'{len(paths_videos)} video files {args.valid_ext} found in \'{args.input}\'')
 
@@ -0,0 +1,253 @@
+# conda activate preprocess_drone_video
+# python 2_watch_ingest_fimix8tele.py --input-folder /media/biesseck/SSD_500GB/Datasets/drone_FIMIX8Tele/videos --frame-folder /media/biesseck/SSD_500GB/Datasets/drone_FIMIX8Tele/frames --suffix _height=9m --frame-ext png,jpg
+# Options not listed in --help are passed to 1_extract_frames_video_fimix8tele.py (--workers, --stride, --output-backend, ...)
+
+import os, sys
+import argparse
+import time
+from datetime import datetime
+import struct
+import select
+import ctypes
+import ctypes.util
+import concurrent.futures
+
+from drone_video import (scan_folder, filename_is_already_formatted, get_new_filename, ignore_progress, parse_extract_args,
+                         get_extraction_kwargs, extract_all_frames_from_video)
+
+
+def parse_args():
+    def list_of_strings(arg):
+        return [ext for ext in arg.split(',') if ext != '']
+
+    parser = argparse.ArgumentParser(description="Watch a folder while the SD card is copied: delete LRV/THM files, rename the videos with their timestamp and extract their frames as soon as they are complete")
+    parser.add_argument('--input-folder', type=str, required=True, help="Folder (and subfolders) receiving the video files")
+    parser.add_argument('--frame-folder', type=str, required=True, help="Folder to save extracted frames")
+
+    parser.add_argument('--delete-ext', type=list_of_strings, default='LRV,THM', help="LRV,THM")
+    parser.add_argument('--valid-ext', type=list_of_strings, default='MP4', help="MP4,AVI")
+    parser.add_argument('--companion-ext', type=list_of_strings, default='LRV,THM', help="Files renamed with their video when they are not deleted")
+    parser.add_argument('--suffix', type=str, default='', help="Suffix to be added in file name. Ex: _height=9m")
+
+    parser.add_argument('--stable-seconds', type=float, default=5.0, help="A file is complete when its size and mtime don't change for this time")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds between checks of the files being copied (and between scans without inotify)")
+    parser.add_argument('--polling', action='store_true', help="Scan the folder periodically instead of using inotify")
+    parser.add_argument('--jobs', type=int, default=2, help="Videos extracted at once")
+    parser.add_argument('--exit-when-idle', action='store_true', help="Exit when every file found is processed, instead of watching forever")
+
+    args, extract_argv = parser.parse_known_args()
+    args.suffix = args.suffix.strip('_')
+    return args, extract_argv
+
+
+class PollingWatcher:
+    # Returns every file of the tree at each call, the StableFileTracker ignores the known ones
+    def __init__(self, folder_path, extensions):
+        self.folder_path = folder_path
+        self.extensions = extensions
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return self.scan()
+
+    def scan(self):
+        return [entry.path for entry in scan_folder(self.folder_path, self.extensions)]
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(PollingWatcher):
+    # inotify through ctypes (Linux only), watches every subfolder and reports files written or moved into them
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, folder_path, extensions):
+        super().__init__(folder_path, extensions)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.folders = {}
+        self.add_folder_tree(folder_path)
+
+    def add_folder_tree(self, folder_path):
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        for root, dirs, files in os.walk(folder_path):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), mask)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {root}')
+            self.folders[wd] = root
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed_paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, name_length = self.EVENT_HEADER.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + self.EVENT_HEADER.size:offset + self.EVENT_HEADER.size + name_length].rstrip(b'\0'))
+            offset += self.EVENT_HEADER.size + name_length
+            if mask & self.IN_Q_OVERFLOW:
+                return self.scan()   # events were lost
+            if wd not in self.folders or name == '':
+                continue
+            path = os.path.join(self.folders[wd], name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self.add_folder_tree(path)
+                    changed_paths += [entry.path for entry in scan_folder(path, self.extensions)]
+            elif path.lower().endswith(tuple(ext.lower() for ext in self.extensions)):
+                changed_paths.append(path)
+        return changed_paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(folder_path, extensions, polling=False):
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(folder_path, extensions)
+        except (OSError, AttributeError) as error:
+            print(f'inotify not available ({error}), scanning the folder every poll interval')
+    return PollingWatcher(folder_path, extensions)
+
+
+class StableFileTracker:
+    # A file is ready once its size and mtime didn't change for `stable_seconds`, so files still
+    # being copied are not touched. Files returned once are not returned again.
+    def __init__(self, stable_seconds=5.0):
+        self.stable_seconds = stable_seconds
+        self.pending = {}   # path: (size, mtime_ns, time of the last change)
+        self.done = set()
+
+    def touch(self, path):
+        if path not in self.done and path not in self.pending:
+            self.pending[path] = (-1, -1, time.time())
+
+    def mark_done(self, path):
+        self.done.add(path)
+        self.pending.pop(path, None)
+
+    def pop_stable(self):
+        now = time.time()
+        stable_paths = []
+        for path, (size, mtime_ns, last_change) in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self.pending[path] = (stat.st_size, stat.st_mtime_ns, now)
+            elif now - last_change >= self.stable_seconds:
+                stable_paths.append(path)
+        for path in stable_paths:
+            self.mark_done(path)
+        return sorted(stable_paths)
+
+
+def rename_video(path_video, suffix='', companion_exts=()):
+    # Same timestamp name as 0_preprocess_videos_fimix8tele.py, keeps the old name if the new one is taken.
+    # The companion files already copied (FIMI0001.LRV) get the new name too.
+    if filename_is_already_formatted(path_video, suffix):
+        return path_video
+    new_path = os.path.join(os.path.dirname(path_video), get_new_filename(os.path.basename(path_video), os.stat(path_video).st_mtime, suffix))
+    path_renames = [(path_video, new_path)] + [(f'{os.path.splitext(path_video)[0]}.{ext}', f'{os.path.splitext(new_path)[0]}.{ext}') for ext in companion_exts]
+    for path_file, new_path_file in path_renames:
+        if not os.path.isfile(path_file):
+            continue
+        if os.path.exists(new_path_file):
+            print(f'    Not renamed, {os.path.basename(new_path_file)} already exists: {path_file}')
+            if path_file == path_video:
+                return path_video
+            continue
+        print(f'RENAMING FILE {path_file}')
+        print(f'              └─> {os.path.basename(new_path_file)}')
+        os.rename(path_file, new_path_file)
+    return new_path
+
+
+def ingest_file(path_file, args, tracker, executor, extraction_kwargs):
+    # Returns the extraction future of a video, None for deleted files
+    # extensions matched case-insensitively, the way scan_folder found the file (FIMI0001.lrv)
+    if path_file.lower().endswith(tuple(ext.lower() for ext in args.delete_ext)) and not path_file.lower().endswith(tuple(ext.lower() for ext in args.valid_ext)):
+        print(f'DELETING FILE {path_file}')
+        os.remove(path_file)
+        return None
+
+    path_video = rename_video(path_file, args.suffix, [ext for ext in args.companion_ext if ext.lower() not in [delete_ext.lower() for delete_ext in args.delete_ext]])
+    tracker.mark_done(path_video)
+    video_name, video_ext = os.path.splitext(os.path.basename(path_video))
+    frame_video_folder = os.path.join(args.frame_folder, os.path.basename(os.path.dirname(path_video)), video_name)
+    os.makedirs(frame_video_folder, exist_ok=True)
+    print(f'QUEUED {path_video} -> {frame_video_folder}')
+    return executor.submit(extract_all_frames_from_video, path_video, frame_video_folder,
+                           progress=ignore_progress, **extraction_kwargs)
+
+
+def watch_and_ingest(args, extraction_kwargs):
+    watcher = create_watcher(args.input_folder, args.delete_ext + args.valid_ext, args.polling)
+    tracker = StableFileTracker(args.stable_seconds)
+    for path_file in watcher.scan():
+        tracker.touch(path_file)
+    print(f'Watching \'{args.input_folder}\' ({type(watcher).__name__}), extracting {args.jobs} videos at once. Ctrl+C to stop.')
+
+    running = {}
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs)
+    try:
+        while True:
+            for path_file in watcher.wait(args.poll_interval):
+                tracker.touch(path_file)
+            for path_file in tracker.pop_stable():
+                future = ingest_file(path_file, args, tracker, executor, extraction_kwargs)
+                if future is not None:
+                    running[future] = path_file
+
+            for future in [future for future in running if future.done()]:
+                path_file = running.pop(future)
+                try:
+                    stats = future.result()
+                    print(f'DONE {os.path.basename(stats["video"])}: {stats["saved"]} frames saved in {stats["seconds"]:.1f}s ({len(running)} running, {len(tracker.pending)} files being copied)')
+                except Exception as error:
+                    print(f'FAILED {path_file}: {error}')
+
+            if args.exit_when_idle and len(running) == 0 and len(tracker.pending) == 0:
+                break
+    except KeyboardInterrupt:
+        print(f'\nStopping, {len(running)} extractions interrupted (they resume from their manifest on the next run)')
+        executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        executor.shutdown(wait=True)
+        watcher.close()
+
+
+
+def main():
+    args, extract_argv = parse_args()
+
+    # Check directories
+    if not os.path.isdir(args.input_folder):
+        raise Exception(f'No such directory: {args.input_folder}')
+    os.makedirs(args.frame_folder, exist_ok=True)
+
+    # the extraction options are parsed by 1_extract_frames_video_fimix8tele.py
+    extract_args = parse_extract_args(['--input', args.input_folder, '--frame-folder', args.frame_folder, '--all'] + extract_argv)
+    extraction_kwargs = get_extraction_kwargs(extract_args)
+    watch_and_ingest(args, extraction_kwargs)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+# conda activate preprocess_drone_video
+# python benchmark_pipeline.py --output bench_results.json
+# python benchmark_pipeline.py --output bench_results_new.json --compare bench_results.json
+# python benchmark_pipeline.py --check-resume
+# python benchmark_pipeline.py --check-corrupt
+# python benchmark_pipeline.py --check-companions
+
+import os, sys
+import cv2
+import numpy as np
+import argparse
+import time
+from datetime import datetime
+import json
+import signal
+import shutil
+import tarfile
+import tempfile
+import platform
+import resource
+import subprocess
+import contextlib
+import concurrent.futures
+import multiprocessing
+
+from drone_video import count_num_frames_video, extract_all_frames_from_video, build_preprocess_plan, apply_preprocess_plan
+
+
+def parse_args():
+    def list_of_strings(arg):
+        return arg.split(',')
+
+    def list_of_ints(arg):
+        return [int(value) for value in arg.split(',')]
+
+    parser = argparse.ArgumentParser(description="Benchmark frame extraction and file renaming on synthetic videos and FIMI-like folders")
+    parser.add_argument('--work-dir', type=str, default='', help="Folder for the synthetic videos and outputs (default: temporary folder, deleted at the end)")
+    parser.add_argument('--output', type=str, default='bench_results.json', help="JSON file with the results")
+    parser.add_argument('--compare', type=str, default='', help="Previous results JSON to compare with")
+
+    parser.add_argument('--resolutions', type=list_of_strings, default='640x360,1920x1080', help="640x360,1920x1080,3840x2160")
+    parser.add_argument('--num-frames', type=list_of_ints, default='60', help="Length of the synthetic videos, 60,300")
+    parser.add_argument('--fps', type=float, default=30.0, help="FPS of the synthetic videos")
+    parser.add_argument('--frame-sets', type=str, default='png;jpg;png,jpg', help="Output format combinations separated by ';'")
+    parser.add_argument('--frame-quality', type=list_of_strings, default='95', help="90,95")
+    parser.add_argument('--workers', type=list_of_ints, default='0', help="Values of --workers to benchmark, 0,4")
+    parser.add_argument('--tree-files', type=int, default=2000, help="Number of MP4 files in the synthetic FIMI folder tree (each one with a LRV and a THM)")
+    parser.add_argument('--check-resume', action='store_true', help="Instead of benchmarking, kill shards extractions after their first checkpoint, resume them and check no frame is missing or duplicated")
+    parser.add_argument('--check-corrupt', action='store_true', help="Instead of benchmarking, extract a folder with a truncated video and a valid one and check the valid one is fully extracted")
+    parser.add_argument('--check-companions', action='store_true', help="Instead of benchmarking, run the watch script on a folder with lowercase LRV/THM files and check they are deleted, not extracted")
+
+    args = parser.parse_args()
+    return args
+
+
+def run_isolated(function, *args, **kwargs):
+    # Runs the function in a fresh process, so the peak RSS measured belongs to this call only
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as executor:
+        return executor.submit(measure_call, function, *args, **kwargs).result()
+
+
+def measure_call(function, *args, **kwargs):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start_time = time.perf_counter()
+        result = function(*args, **kwargs)
+        seconds = time.perf_counter() - start_time
+    peak_rss_mb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+    return result, seconds, peak_rss_mb
+
+
+def generate_video(video_path, width, height, num_frames, fps=30.0):
+    # Textured frames with camera-like motion and sensor noise, so the encoders get realistic work
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    if not writer.isOpened():
+        raise Exception(f'Error: Unable to create video file: {video_path}')
+    rng = np.random.default_rng(0)
+    texture = cv2.resize(rng.integers(0, 256, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8), (width * 2, height * 2), interpolation=cv2.INTER_CUBIC)
+    for idx_frame in range(num_frames):
+        offset_x = int(idx_frame * width / (2 * max(1, num_frames)))
+        offset_y = int(idx_frame * height / (4 * max(1, num_frames)))
+        frame = texture[offset_y:offset_y+height, offset_x:offset_x+width].copy()
+        frame = cv2.add(frame, rng.integers(0, 8, frame.shape, dtype=np.uint8))
+        writer.write(frame)
+    writer.release()
+
+
+def generate_fimi_tree(tree_path, num_files):
+    # 100DRONE-like folders with MP4 videos and their LRV proxies and THM thumbnails
+    if os.path.exists(tree_path):
+        shutil.rmtree(tree_path)
+    num_folders = max(1, num_files // 500)
+    mtime = datetime(2024, 9, 22, 15, 30, 25).timestamp()
+    for idx_file in range(num_files):
+        folder_path = os.path.join(tree_path, f'{100 + idx_file % num_folders}DRONE_2024-09-22_height=9m')
+        os.makedirs(folder_path, exist_ok=True)
+        for ext, size in (('MP4', 1024), ('LRV', 256), ('THM', 64)):
+            file_path = os.path.join(folder_path, f'FIMI{idx_file:04d}.{ext}')
+            with open(file_path, 'wb') as fimi_file:
+                fimi_file.write(b'\0' * size)
+            os.utime(file_path, (mtime + idx_file, mtime + idx_file))
+
+
+def decode_video(video_path):
+    cap = cv2.VideoCapture(video_path)
+    num_frames = 0
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+        num_frames += 1
+    cap.release()
+    return num_frames
+
+
+def run_preprocess(tree_path):
+    # what 0_preprocess_videos_fimix8tele.py --delete-ext LRV,THM --valid-ext MP4 does
+    plan = build_preprocess_plan(tree_path, ['LRV', 'THM'], ['MP4'], companion_exts=['LRV', 'THM'])
+    apply_preprocess_plan(plan)
+
+
+def benchmark_video(args, work_dir, width, height, num_frames):
+    video_path = os.path.join(work_dir, 'videos', f'SYNTH_{width}x{height}_{num_frames}.MP4')
+    os.makedirs(os.path.dirname(video_path), exist_ok=True)
+    if not os.path.isfile(video_path):
+        generate_video(video_path, width, height, num_frames, args.fps)
+    print(f'VIDEO {width}x{height}, {num_frames} frames: {video_path}')
+
+    result = {'resolution': f'{width}x{height}', 'num_frames': num_frames, 'video_bytes': os.path.getsize(video_path)}
+    count, seconds, peak_rss_mb = run_isolated(count_num_frames_video, video_path)
+    result['count_num_frames_video'] = {'seconds': seconds, 'peak_rss_mb': peak_rss_mb}
+    print(f'    count_num_frames_video: {seconds*1000:.1f} ms')
+
+    decoded, seconds, peak_rss_mb = run_isolated(decode_video, video_path)
+    result['decode'] = {'seconds': seconds, 'fps': decoded / max(seconds, 1e-9), 'peak_rss_mb': peak_rss_mb}
+    print(f'    decode: {decoded / max(seconds, 1e-9):.1f} fps')
+
+    result['extract'] = []
+    for frame_set in args.frame_sets.split(';'):
+        for num_workers in args.workers:
+            frames_path = os.path.join(work_dir, 'frames', f'{width}x{height}_{num_frames}_{frame_set}_{num_workers}')
+            if os.path.exists(frames_path):
+                shutil.rmtree(frames_path)
+            os.makedirs(frames_path)
+            stats, seconds, peak_rss_mb = run_isolated(extract_all_frames_from_video, video_path, frames_path,
+                                                       frame_exts=frame_set.split(','), frame_quality=args.frame_quality,
+                                                       num_workers=num_workers, force=True)
+            result['extract'].append({'frame_ext': frame_set, 'frame_quality': ','.join(args.frame_quality), 'workers': num_workers,
+                                      'seconds': seconds, 'encode_fps': stats['saved'] / max(seconds, 1e-9),
+                                      'bytes_written': stats['bytes'], 'peak_rss_mb': peak_rss_mb, 'stages': stats['stages']})
+            print(f'    extract {frame_set} (quality {",".join(args.frame_quality)}, {num_workers} workers): '
+                  f'{stats["saved"] / max(seconds, 1e-9):.1f} fps, {stats["bytes"] / (1024*1024):.1f} MB, peak RSS {peak_rss_mb:.0f} MB')
+            shutil.rmtree(frames_path)
+    return result
+
+
+def benchmark_preprocess(work_dir, num_files):
+    tree_path = os.path.join(work_dir, 'tree')
+    generate_fimi_tree(tree_path, num_files)
+    print(f'TREE {num_files} MP4 + LRV + THM files: {tree_path}')
+    result, seconds, peak_rss_mb = run_isolated(run_preprocess, tree_path)
+    shutil.rmtree(tree_path)
+    print(f'    0_preprocess_videos_fimix8tele: {seconds:.2f} s, {3 * num_files / max(seconds, 1e-9):.0f} files/s')
+    return {'num_files': 3 * num_files, 'seconds': seconds, 'files_per_s': 3 * num_files / max(seconds, 1e-9), 'peak_rss_mb': peak_rss_mb}
+
+
+def get_shard_members(frames_path):
+    members = []
+    for filename in sorted(os.listdir(frames_path)):
+        if filename.endswith('.tar'):
+            with tarfile.open(os.path.join(frames_path, filename)) as tar:
+                members += tar.getnames()
+    return members
+
+
+def run_killed_extraction(extract_command, frames_path, timeout=120.0):
+    # Starts the extraction and kills it with SIGKILL once the manifest has a checkpoint of this run past the first frame
+    manifest_path = os.path.join(frames_path, 'extraction_manifest.json')
+    process = subprocess.Popen(extract_command, stdout=subprocess.DEVNULL)
+    start_time = time.time()
+    last_frame = -1
+    while process.poll() is None and last_frame < 0 and time.time() - start_time < timeout:
+        time.sleep(0.05)
+        try:
+            with open(manifest_path, 'r') as manifest_file:
+                output_states = json.load(manifest_file)['outputs'].values()
+        except (OSError, ValueError):
+            continue
+        if not all(output_state['complete'] for output_state in output_states):
+            last_frame = min(output_state['last_frame'] for output_state in output_states)
+    if process.poll() is not None:
+        raise Exception('Error: the extraction finished before its first checkpoint, use a longer video')
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+    return last_frame
+
+
+def check_shard_resume(work_dir, fps=30.0, num_frames=1800):
+    # Kill/resume check of the shards backend: a resumed run, a --force run and a run with other encoder
+    # options must leave exactly one member per frame and output in the shards
+    video_path = os.path.join(work_dir, 'videos', f'SYNTH_640x360_{num_frames}.MP4')
+    os.makedirs(os.path.dirname(video_path), exist_ok=True)
+    if not os.path.isfile(video_path):
+        generate_video(video_path, 640, 360, num_frames, fps)
+    frame_folder = os.path.join(work_dir, 'frames_resume')
+    if os.path.exists(frame_folder):
+        shutil.rmtree(frame_folder)
+    frames_path = os.path.join(frame_folder, 'videos', os.path.splitext(os.path.basename(video_path))[0])
+    extract_command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), '1_extract_frames_video_fimix8tele.py'),
+                       '--input', video_path, '--frame-folder', frame_folder, '--all', '--frame-ext', 'png,jpg',
+                       '--output-backend', 'shards', '--shard-size-mb', '2', '--workers', '2']
+    num_failed = 0
+    for name, resume_options in (('resumed', []), ('forced', ['--force']), ('new encoder options', ['--png-compression', '1'])):
+        killed_at = run_killed_extraction(extract_command + resume_options, frames_path)
+        subprocess.run(extract_command + resume_options, stdout=subprocess.DEVNULL, check=True)
+        members = get_shard_members(frames_path)
+        ok = len(members) == len(set(members)) == 2 * num_frames
+        num_failed += not ok
+        print(f'    {"OK  " if ok else "FAIL"} {name} (killed after frame {killed_at}): {len(members)} members, {len(set(members))} unique, {2 * num_frames} expected')
+    return num_failed
+
+
+def check_corrupt_folder(work_dir, fps=30.0, num_frames=60):
+    # A truncated clip in the folder is skipped: the sequential and the --jobs runs must still extract every
+    # frame of the valid video and exit without error
+    videos_path = os.path.join(work_dir, 'videos_corrupt', '100DRONE')
+    os.makedirs(videos_path, exist_ok=True)
+    valid_path = os.path.join(videos_path, 'FIMI0001.MP4')
+    if not os.path.isfile(valid_path):
+        generate_video(valid_path, 320, 180, num_frames, fps)
+    with open(valid_path, 'rb') as file_valid, open(os.path.join(videos_path, 'FIMI0000.MP4'), 'wb') as file_corrupt:
+        file_corrupt.write(file_valid.read(2000))   # header only, the way an interrupted copy leaves it
+    num_failed = 0
+    for name, jobs_options in (('sequential', []), ('jobs', ['--jobs', '2'])):
+        frame_folder = os.path.join(work_dir, 'frames_corrupt')
+        if os.path.exists(frame_folder):
+            shutil.rmtree(frame_folder)
+        result = subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), '1_extract_frames_video_fimix8tele.py'),
+                                 '--input', videos_path, '--frame-folder', frame_folder, '--all', '--frame-ext', 'png'] + jobs_options,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        frames_path = os.path.join(frame_folder, '100DRONE', 'FIMI0001')
+        num_saved = len([file for file in os.listdir(frames_path) if file.endswith('.png')]) if os.path.isdir(frames_path) else 0
+        ok = result.returncode == 0 and num_saved == num_frames
+        num_failed += not ok
+        print(f'    {"OK  " if ok else "FAIL"} {name}: exit code {result.returncode}, {num_saved} frames of the valid video, {num_frames} expected')
+    return num_failed
+
+
+def check_watch_companions(work_dir, fps=30.0, num_frames=30):
+    # The watch script deletes the companion files whatever the case of their extension (FIMI0001.lrv),
+    # and only the video is extracted
+    videos_path = os.path.join(work_dir, 'videos_companions', '100DRONE')
+    if os.path.exists(videos_path):
+        shutil.rmtree(videos_path)
+    os.makedirs(videos_path)
+    generate_video(os.path.join(videos_path, 'FIMI0001.MP4'), 320, 180, num_frames, fps)
+    for companion_name in ('FIMI0001.lrv', 'FIMI0001.thm', 'FIMI0002.LRV'):
+        with open(os.path.join(videos_path, companion_name), 'wb') as file:
+            file.write(b'\0' * 1024)
+    frame_folder = os.path.join(work_dir, 'frames_companions')
+    if os.path.exists(frame_folder):
+        shutil.rmtree(frame_folder)
+    result = subprocess.run([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), '2_watch_ingest_fimix8tele.py'),
+                             '--input-folder', videos_path, '--frame-folder', frame_folder, '--polling', '--exit-when-idle',
+                             '--stable-seconds', '0', '--poll-interval', '0.1', '--jobs', '1', '--frame-ext', 'png'],
+                            capture_output=True, text=True)
+    left_files = sorted(file for file in os.listdir(videos_path) if not file.upper().endswith('.MP4'))
+    frame_videos = sorted(os.listdir(os.path.join(frame_folder, '100DRONE'))) if os.path.isdir(os.path.join(frame_folder, '100DRONE')) else []
+    ok = result.returncode == 0 and left_files == [] and len(frame_videos) == 1 and 'FAILED' not in result.stdout
+    print(f'    {"OK  " if ok else "FAIL"} lowercase companions: exit code {result.returncode}, companions left {left_files}, extracted {frame_videos}')
+    return int(not ok)
+
+
+def get_environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit, 'date': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'opencv': cv2.__version__, 'numpy': np.__version__, 'platform': platform.platform(), 'cpu_count': os.cpu_count()}
+
+
+def flatten_results(results):
+    # {'metric name': value} for the metrics compared between runs
+    metrics = {}
+    for video in results['videos']:
+        name = f"{video['resolution']}_{video['num_frames']}"
+        metrics[f'{name} count_num_frames_video s'] = video['count_num_frames_video']['seconds']
+        metrics[f'{name} decode fps'] = video['decode']['fps']
+        for extract in video['extract']:
+            metrics[f"{name} extract {extract['frame_ext']} q{extract['frame_quality']} w{extract['workers']} fps"] = extract['encode_fps']
+            metrics[f"{name} extract {extract['frame_ext']} q{extract['frame_quality']} w{extract['workers']} MB"] = extract['bytes_written'] / (1024*1024)
+    if 'preprocess' in results:
+        metrics['preprocess files/s'] = results['preprocess']['files_per_s']
+    return metrics
+
+
+def compare_results(previous, current):
+    previous_metrics, current_metrics = flatten_results(previous), flatten_results(current)
+    print(f"COMPARISON {previous['environment']['commit'] or previous['environment']['date']} -> {current['environment']['commit'] or current['environment']['date']}")
+    for name, value in current_metrics.items():
+        if name in previous_metrics and previous_metrics[name] > 0:
+            print(f'    {name}: {previous_metrics[name]:.2f} -> {value:.2f} ({value / previous_metrics[name]:.2f}x)')
+
+
+
+def main():
+    args = parse_args()
+    os.environ['DRONE_VIDEO_METADATA_CACHE'] = ''   # measures cold runs, without the cached video metadata
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bench_drone_video_')
+    os.makedirs(work_dir, exist_ok=True)
+    if args.check_resume:
+        try:
+            print('RESUME CHECK shards backend')
+            num_failed = check_shard_resume(work_dir, args.fps)
+        finally:
+            if not args.work_dir:
+                shutil.rmtree(work_dir)
+        sys.exit(1 if num_failed > 0 else 0)
+    if args.check_corrupt:
+        try:
+            print('CORRUPT VIDEO CHECK folder extraction')
+            num_failed = check_corrupt_folder(work_dir, args.fps)
+        finally:
+            if not args.work_dir:
+                shutil.rmtree(work_dir)
+        sys.exit(1 if num_failed > 0 else 0)
+    if args.check_companions:
+        try:
+            print('COMPANION FILES CHECK watch script')
+            num_failed = check_watch_companions(work_dir, args.fps)
+        finally:
+            if not args.work_dir:
+                shutil.rmtree(work_dir)
+        sys.exit(1 if num_failed > 0 else 0)
+    try:
+        results = {'environment': get_environment(), 'videos': []}
+        for resolution in args.resolutions:
+            width, height = [int(value) for value in resolution.lower().split('x')]
+            for num_frames in args.num_frames:
+                results['videos'].append(benchmark_video(args, work_dir, width, height, num_frames))
+        if args.tree_files > 0:
+            results['preprocess'] = benchmark_preprocess(work_dir, args.tree_files)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f'Results saved in \'{args.output}\'')
+
+    if args.compare:
+        with open(args.compare, 'r') as compare_file:
+            compare_results(json.load(compare_file), results)
+
+
+
+if __name__ == "__main__":
+    main()
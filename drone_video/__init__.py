@@ -0,0 +1,32 @@
+# Frame extraction from the drone videos as a library: the numbered scripts of the repository are
+# command-line wrappers around this package.
+#
+#     from drone_video import FrameSource
+#     for idx_frame, timestamp, frame in FrameSource('FIMI0001.MP4', target_fps=2.0):
+#         ...
+#
+#     from drone_video import FrameSource, MemoryFrameWriter, get_frame_outputs, extract_frame_range
+#     sink = MemoryFrameWriter()
+#     with FrameSource('FIMI0001.MP4', stride=30) as frame_source:
+#         extract_frame_range(frame_source, sink, get_frame_outputs(['jpg'], [95]), num_workers=4)
+#         # progress=ThrottledProgress(print_progress) to show a progress line
+#     sink.frames   # {frame index: {'jpg_JPEG_QUALITY=95': bytes}}
+
+from .video_metadata import VideoMetadata, get_video_metadata, get_keyframe_indices, count_num_frames_video
+from .files import (find_files_with_extensions, scan_folder, timeConvert, filename_is_already_formatted, get_new_filename, get_filename_time,
+                    build_preprocess_plan, print_preprocess_plan, apply_preprocess_plan)
+from .encoding import (FrameOutput, get_encoder_options, get_frame_transform, check_frame_transform, get_frame_outputs, get_frame_paths,
+                       get_output_key, encode_frame_outputs, save_frame)
+from .selection import (get_frame_selection, FrameSelector, DedupIndex, compute_frame_hash,
+                        get_selection_path, load_selection, save_selection, get_selection_ranges)
+from .source import FrameSource, FrameBufferPool, read_next_frame
+from .sinks import (FrameSink, FileFrameWriter, ShardFrameWriter, ArchiveFrameWriter, MemoryFrameWriter, create_frame_writer,
+                    read_archive_frame)
+from .progress import print_progress, ignore_progress, ThrottledProgress, clear_terminal_line, StageMetrics, MetricsWriter, print_throughput_summary
+from .manifest import load_manifest
+from .frame_index import FrameIndex, compute_frame_stats, load_frame_index, query_frame_index, find_frames
+from .extract import (extract_frame_range, extract_all_frames_from_video, extract_videos_parallel, verify_extracted_frames,
+                      plan_cpu_budget, plan_memory_budget)
+from .cli import parse_extract_args, get_extraction_kwargs
+from .frame_cache import FrameCache, PreviewFrames
+from .display import start_monitoring_cv2_window
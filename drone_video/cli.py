@@ -0,0 +1,86 @@
+# Command-line options of the extraction, shared by 1_extract_frames_video_fimix8tele.py and the watch
+# script, and their conversion to the keyword arguments of extract_all_frames_from_video().
+
+import os, sys
+import argparse
+
+from .encoding import get_encoder_options, get_frame_transform
+from .selection import get_frame_selection
+
+
+def parse_extract_args(argv=None):
+    # Options of 1_extract_frames_video_fimix8tele.py, also parsed by the watch script for the extractions it starts
+    def list_of_strings(arg):
+        return arg.split(',')
+
+    parser = argparse.ArgumentParser(description="Extract frames from videos")
+    parser.add_argument('--input', type=str, required=True, help="Folder containing video files to preprocess")
+    parser.add_argument('--frame-folder', type=str, required=True, help="Folder to save extracted frames")
+    
+    parser.add_argument('--valid-ext', type=list_of_strings, default='MP4', help="MP4,AVI")
+    parser.add_argument('--frame-ext', type=list_of_strings, default='png,jpg', help="png,jpg")
+    parser.add_argument('--frame-quality', type=list_of_strings, default='95', help="90,95")  # ignored if --frame-ext=png'
+    
+    parser.add_argument('--all', action='store_true', help="Extract all frames from video (or the ones selected by the options below)")
+    parser.add_argument('--stride', type=int, default=1, help="Save every Nth frame")
+    parser.add_argument('--target-fps', type=float, default=0.0, help="Save frames at this rate (0: video rate)")
+    parser.add_argument('--start', type=float, default=0.0, help="Start of the extracted window, in seconds")
+    parser.add_argument('--end', type=float, default=-1.0, help="End of the extracted window, in seconds (-1: end of video)")
+    parser.add_argument('--scene-threshold', type=float, default=0.0, help="Save a frame only if it differs from the last saved one by at least this score (0: disabled, ex: 0.05)")
+    parser.add_argument('--scene-metric', type=str, default='diff', choices=['diff', 'hist'], help="diff: mean absolute difference, hist: histogram distance (64x36 grayscale)")
+    parser.add_argument('--dedup-hash', type=str, default='', choices=['', 'dhash', 'phash'], help="Skip frames whose perceptual hash is within --dedup-distance bits of a recently kept frame, of this or of other videos ('': disabled)")
+    parser.add_argument('--dedup-distance', type=int, default=6, help="Max Hamming distance (of 64 bits) between the hashes of near-duplicate frames")
+    parser.add_argument('--dedup-window', type=int, default=4096, help="Number of recently kept hashes compared with each frame")
+    parser.add_argument('--dedup-index', type=str, default='', help="File of the hashes kept, shared by the videos and the runs (default: dedup_index.npz next to the frame folder of each video)")
+    parser.add_argument('--png-compression', type=int, default=-1, help="PNG compression level 0-9 (-1: OpenCV default)")
+    parser.add_argument('--jpeg-progressive', action='store_true', help="Write progressive JPEGs")
+    parser.add_argument('--jpeg-optimize', action='store_true', help="Optimize the JPEG Huffman tables")
+    parser.add_argument('--crop', type=str, default='', help="Region of interest x,y,width,height cropped before resizing and encoding")
+    parser.add_argument('--resize', type=list_of_strings, default='full', help="Output sizes, full,1280,640x360,0.5 (1280: longest side in pixels, 0.5: scale). Several sizes add a size suffix to the names")
+    parser.add_argument('--jpeg-subsampling', type=str, default='', choices=['', '444', '422', '420', '440', '411'], help="JPEG chroma subsampling ('': OpenCV default)")
+    parser.add_argument('--output-backend', type=str, default='files', choices=['files', 'shards', 'archive'], help="files: one image per frame, shards: tar shards, archive: one data file + offset index per video")
+    parser.add_argument('--shard-size-mb', type=float, default=1024, help="Max size of a tar shard with --output-backend shards")
+    parser.add_argument('--workers', type=int, default=0, help="Encoder/writer workers used with --all (0: encode and write in the decoding thread)")
+    parser.add_argument('--queue-depth', type=int, default=0, help="Max decoded frames waiting for the workers (0: 2x --workers)")
+    parser.add_argument('--process-pool', action='store_true', help="Use a process pool instead of a thread pool for --workers")
+    parser.add_argument('--jobs', type=int, default=1, help="Videos extracted at once when --input is a folder (0: as many as --cpus allows)")
+    parser.add_argument('--segments', type=int, default=1, help="Split each video at keyframes and decode the segments in parallel processes")
+    parser.add_argument('--verify-segments', action='store_true', help="After a --segments extraction, check the output is byte-identical to a sequential run")
+    parser.add_argument('--cache-mb', type=int, default=512, help="Manual mode: memory for the decoded frames kept to step back and forward instantly")
+    parser.add_argument('--read-ahead', type=int, default=16, help="Manual mode: frames decoded ahead of the playback in background")
+    parser.add_argument('--preview', type=str, default='off', choices=['off', 'lrv', 'scale', 'auto'], help="Manual mode: show the LRV proxy (lrv), frames scaled to --preview-width (scale) or the LRV if it exists (auto), frames are always saved at full resolution")
+    parser.add_argument('--preview-width', type=int, default=1280, help="Manual mode: width of the scaled preview frames")
+    parser.add_argument('--from-selection', action='store_true', help="Extract (without display) only the frames in the selection file of each video (<video>.selection.json, made with the m/r keys in manual mode), skipping videos without one")
+    parser.add_argument('--save-threads', type=int, default=2, help="Manual mode: threads saving the selected frames in background")
+    parser.add_argument('--max-pending-saves', type=int, default=8, help="Manual mode: frames waiting to be saved before 's' blocks the playback")
+    parser.add_argument('--progress-hz', type=float, default=4.0, help="Max refresh rate of the progress line")
+    parser.add_argument('--metrics-file', type=str, default='', help="Append per-video and per-run metrics to this JSONL file (Prometheus text format if it ends with .prom)")
+    parser.add_argument('--frame-index', type=list_of_strings, default='npz', help="Formats of the per-frame index <video>.frame_index.* (timestamps, output paths and sizes, sharpness, brightness): npz,csv ('': none)")
+    parser.add_argument('--max-memory', type=float, default=0, help="MB for the frames held by the extraction (decoded, being encoded, waiting to be written), shared by --jobs and --segments (0: no limit on the frames in flight, 512 MB of files waiting to be written). Sets --queue-depth")
+    parser.add_argument('--cpus', type=int, default=os.cpu_count(), help="CPU budget shared by --jobs and --workers")
+    parser.add_argument('-f', '--force', action='store_true', help="Extract videos again, even if their manifest says they are already extracted")
+    
+    args = parser.parse_args(argv)
+    args.frame_index = [index_format for index_format in args.frame_index if index_format != '']
+    if any(index_format not in ('npz', 'csv') for index_format in args.frame_index):
+        parser.error(f"--frame-index formats are npz and csv, not {','.join(args.frame_index)}")
+    if args.from_selection:
+        args.all = True   # bulk extraction, no display
+    return args
+
+
+def get_extraction_kwargs(args):
+    return {'frame_exts': args.frame_ext, 'frame_quality': args.frame_quality,
+            'num_workers': args.workers, 'queue_depth': args.queue_depth, 'use_processes': args.process_pool,
+            'num_segments': args.segments, 'verify_segments': args.verify_segments, 'force': args.force,
+            'frame_selection': get_frame_selection(args.stride, args.target_fps, args.start, args.end,
+                                                   args.scene_threshold, args.scene_metric, dedup_hash=args.dedup_hash,
+                                                   dedup_distance=args.dedup_distance, dedup_window=args.dedup_window),
+            'output_backend': args.output_backend, 'shard_size_mb': args.shard_size_mb,
+            'encoder_options': get_encoder_options(args.png_compression, args.jpeg_progressive, args.jpeg_optimize, args.jpeg_subsampling),
+            'frame_transform': get_frame_transform(args.crop, args.resize),
+            'from_selection': args.from_selection,
+            'dedup_index_path': args.dedup_index,
+            'max_memory_mb': args.max_memory,
+            'frame_index_formats': args.frame_index,
+            'progress_hz': args.progress_hz}
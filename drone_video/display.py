@@ -0,0 +1,21 @@
+# OpenCV windows of the interactive players.
+
+import os, sys
+import cv2
+import time
+import threading
+
+
+def start_monitoring_cv2_window(window_name='', on_close=None):
+    def check_window_is_open():
+        while True:
+            if cv2.getWindowProperty(window_name, 0) >= 0:
+                if not cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE):   # windows is open
+                    print("\nWindow closed")
+                    if on_close is not None:
+                        on_close()
+                    os._exit(0)
+            time.sleep(0.5)
+
+    thread = threading.Thread(target=check_window_is_open)
+    thread.start()
@@ -0,0 +1,205 @@
+# Output formats of the extracted frames (extension, quality, encoder parameters, crop and sizes),
+# in-memory encoding of a frame for every output and the names of the frame files.
+
+import os, sys
+import cv2
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from collections import namedtuple
+
+from .frame_index import compute_frame_stats
+
+
+FrameOutput = namedtuple('FrameOutput', ['ext', 'quality', 'suffix', 'params', 'crop', 'resize', 'resize_suffix'], defaults=(None, 'full', ''))
+
+
+def get_encoder_options(png_compression=-1, jpeg_progressive=False, jpeg_optimize=False, jpeg_subsampling=''):
+    # png_compression=-1 and jpeg_subsampling='' keep the OpenCV defaults
+    return {'png_compression': png_compression, 'jpeg_progressive': jpeg_progressive,
+            'jpeg_optimize': jpeg_optimize, 'jpeg_subsampling': jpeg_subsampling}
+
+
+def get_encode_params(frame_path, frame_quality=95, encoder_options=None):
+    # `frame_path` can also be just the extension
+    if encoder_options is None:
+        encoder_options = get_encoder_options()
+    if frame_path.endswith('jpg'):
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), int(frame_quality)]
+        if encoder_options['jpeg_progressive']:
+            params += [int(cv2.IMWRITE_JPEG_PROGRESSIVE), 1]
+        if encoder_options['jpeg_optimize']:
+            params += [int(cv2.IMWRITE_JPEG_OPTIMIZE), 1]
+        if encoder_options['jpeg_subsampling']:
+            params += [int(cv2.IMWRITE_JPEG_SAMPLING_FACTOR), int(getattr(cv2, f"IMWRITE_JPEG_SAMPLING_FACTOR_{encoder_options['jpeg_subsampling']}"))]
+        return params
+    if frame_path.endswith('png') and encoder_options['png_compression'] >= 0:
+        return [int(cv2.IMWRITE_PNG_COMPRESSION), int(encoder_options['png_compression'])]
+    return []
+
+
+def save_frame(frame_path, frame, frame_quality=95):
+    return cv2.imwrite(frame_path, frame, get_encode_params(frame_path, frame_quality))
+
+
+def get_frame_transform(crop='', resize=['full']):
+    # crop='x,y,w,h' is applied first, then every resize gives its own set of outputs:
+    # 'full' keeps the size, '1280' limits the longest side, '640x360' is an exact size, '0.5' a scale
+    try:
+        crop_values = tuple(int(value) for value in crop.split(',')) if crop else None
+    except ValueError:
+        crop_values = ()
+    if crop_values is not None and (len(crop_values) != 4 or min(crop_values[:2]) < 0 or min(crop_values[2:]) <= 0):
+        raise Exception(f'Error: --crop must be x,y,width,height in pixels, got {crop}')
+    resize = [str(size).strip().lower() for size in resize] or ['full']
+    for size in resize:
+        if not is_valid_resize(size):
+            raise Exception(f'Error: --resize sizes must be full, a longest side (1280), a size (640x360) or a scale (0.5), got {size}')
+    return {'crop': crop_values, 'resize': list(dict.fromkeys(resize))}
+
+
+def is_valid_resize(resize):
+    try:
+        if resize == 'full':
+            return True
+        if 'x' in resize:
+            sizes = [int(value) for value in resize.split('x')]
+            return len(sizes) == 2 and min(sizes) > 0
+        return float(resize) > 0 if '.' in resize else int(resize) > 0
+    except ValueError:
+        return False
+
+
+def check_frame_transform(frame_transform, width, height):
+    # Checks the crop against the frame size before extracting: a crop partly outside the
+    # frames is clamped to them by transform_frame(), one entirely outside is an error
+    if frame_transform is None or frame_transform['crop'] is None or width <= 0 or height <= 0:
+        return
+    x, y, crop_width, crop_height = frame_transform['crop']
+    if x >= width or y >= height:
+        raise Exception(f'Error: --crop {x},{y},{crop_width},{crop_height} is outside the {width}x{height} frames')
+
+
+def get_resize_suffix(resize):
+    if resize == 'full' or 'x' in resize:
+        return f'_{resize}'
+    if '.' in resize:
+        return f'_x{resize}'
+    return f'_{resize}px'
+
+
+def get_resized_shape(resize, width, height):
+    # (width, height) of the resized frame, None to keep the frame as it is
+    if resize == 'full':
+        return None
+    if 'x' in resize:
+        new_width, new_height = [int(value) for value in resize.split('x')]
+    elif '.' in resize:
+        new_width, new_height = round(width * float(resize)), round(height * float(resize))
+    else:
+        scale = int(resize) / max(width, height)
+        if scale >= 1:
+            return None   # never upscales to a longest side
+        new_width, new_height = round(width * scale), round(height * scale)
+    if (new_width, new_height) == (width, height):
+        return None
+    return max(1, new_width), max(1, new_height)
+
+
+def transform_frame(frame, crop=None, resize='full'):
+    if crop is not None:
+        x, y, crop_width, crop_height = crop
+        frame = frame[y:y+crop_height, x:x+crop_width]
+    new_shape = get_resized_shape(resize, frame.shape[1], frame.shape[0])
+    if new_shape is None:
+        return frame
+    # INTER_AREA averages the source pixels when downscaling (no aliasing on fine textures)
+    interpolation = cv2.INTER_AREA if new_shape[0] < frame.shape[1] else cv2.INTER_LINEAR
+    return cv2.resize(frame, new_shape, interpolation=interpolation)
+
+
+def get_frame_outputs(frame_exts, frame_quality, encoder_options=None, frame_transform=None):
+    # one (ext, quality, suffix, encode params, crop, resize) entry per image written for each frame,
+    # the encode params are built once here instead of once per frame
+    if frame_transform is None:
+        frame_transform = get_frame_transform()
+    frame_outputs = []
+    for resize in frame_transform['resize']:
+        # the names only get a size suffix when there are several sizes
+        resize_suffix = get_resize_suffix(resize) if len(frame_transform['resize']) > 1 else ''
+        for frame_ext in frame_exts:
+            if frame_ext.endswith('jpg'):
+                for frame_qual in frame_quality:
+                    frame_output = FrameOutput(frame_ext, frame_qual, f'{resize_suffix}_JPEG_QUALITY={frame_qual}', get_encode_params(frame_ext, frame_qual, encoder_options),
+                                               frame_transform['crop'], resize, resize_suffix)
+                    if frame_output not in frame_outputs:
+                        frame_outputs.append(frame_output)
+            else:
+                frame_output = FrameOutput(frame_ext, None, resize_suffix, get_encode_params(frame_ext, 95, encoder_options),
+                                           frame_transform['crop'], resize, resize_suffix)
+                if frame_output not in frame_outputs:
+                    frame_outputs.append(frame_output)
+    return frame_outputs
+
+
+def get_frame_paths(frames_path, video_name, idx_frame, frame_outputs):
+    frame_paths = []
+    for frame_output in frame_outputs:
+        frame_filename = f"{video_name}_frame_{idx_frame:06d}{frame_output.suffix}.{frame_output.ext}"
+        frame_paths.append((os.path.join(frames_path, frame_filename), frame_output.quality))
+    return frame_paths
+
+
+def encode_frame_outputs(frame, frame_outputs, with_stats=False):
+    # Encodes the frame in memory once per output, returns the list of encoded bytes, the seconds spent per stage
+    # and, if `with_stats`, the (sharpness, brightness) of the frame for the frame index (None otherwise).
+    # The crop and resize are computed once per size and shared by all the formats and qualities of that size.
+    # The frame is made contiguous once and shared by all the encoders; the color conversion
+    # and DCT of every JPEG quality stay inside libjpeg and can't be shared.
+    transformed_frames = {}
+    encoded_frames = []
+    stage_seconds = {}
+    for frame_output in frame_outputs:
+        transform = (frame_output.crop, frame_output.resize)
+        if transform not in transformed_frames:
+            start = time.perf_counter()
+            transformed_frames[transform] = np.ascontiguousarray(transform_frame(frame, frame_output.crop, frame_output.resize))
+            if transform != (None, 'full'):
+                stage_seconds[f'transform {frame_output.resize}'] = time.perf_counter() - start
+        start = time.perf_counter()
+        ret, encoded = cv2.imencode(f'.{frame_output.ext}', transformed_frames[transform], frame_output.params)
+        if not ret:
+            raise Exception(f'Error: Unable to encode frame as {frame_output.ext}')
+        encoded_frames.append(encoded.tobytes())
+        stage_seconds[f'encode {get_output_key(frame_output)}'] = time.perf_counter() - start
+    frame_stats = None
+    if with_stats:
+        start = time.perf_counter()
+        frame_stats = compute_frame_stats(frame)
+        stage_seconds['frame stats'] = time.perf_counter() - start
+    return encoded_frames, stage_seconds, frame_stats
+
+
+attached_frame_blocks = {}
+
+
+def encode_shared_frame_outputs(block_name, shape, dtype, frame_outputs, with_stats=False):
+    # encode_frame_outputs() for the worker processes: the frame is read from a shared memory block of the
+    # FrameBufferPool instead of being pickled. Blocks are mapped once per worker and reused for the next frames.
+    if block_name not in attached_frame_blocks:
+        attached_frame_blocks[block_name] = shared_memory.SharedMemory(name=block_name)
+    frame = np.ndarray(shape, dtype, buffer=attached_frame_blocks[block_name].buf)
+    return encode_frame_outputs(frame, frame_outputs, with_stats)
+
+
+def add_encode_metrics(metrics, stage_seconds):
+    for stage, seconds in stage_seconds.items():
+        metrics.add(stage, seconds)
+
+
+def get_output_key(frame_output):
+    return f'{frame_output.ext}{frame_output.suffix}'
+
+
+def get_output_transform(frame_output):
+    return [list(frame_output.crop) if frame_output.crop is not None else None, frame_output.resize]
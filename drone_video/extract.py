@@ -0,0 +1,469 @@
+# Extraction engine: decodes a FrameSource, encodes the frames for every output (in the calling thread or in
+# a thread/process pool) and writes them in order to a frame sink, checkpointing the manifest. Long videos
+# can be split in segments decoded in parallel, and folders extracted several videos at once.
+
+import os, sys
+import cv2
+import time
+import queue
+import bisect
+import contextlib
+import collections
+import concurrent.futures
+import multiprocessing
+
+from .video_metadata import count_num_frames_video, get_video_metadata, get_keyframe_indices
+from .encoding import (get_frame_outputs, get_frame_paths, get_output_key, check_frame_transform, encode_frame_outputs, encode_shared_frame_outputs,
+                       add_encode_metrics)
+from .sinks import DEFAULT_MAX_PENDING_BYTES, FileFrameWriter, create_frame_writer
+from .progress import print_progress, ignore_progress, ThrottledProgress, StageMetrics, MultiLineProgress
+from .selection import get_frame_selection, DedupIndex, FrameSelector, get_selection_path, load_selection, get_selection_ranges
+from .source import FrameSource, FrameBufferPool
+from .manifest import FrameWatermark, plan_extraction_resume, ManifestCheckpoint
+from .frame_index import FrameIndex, get_video_start_time
+
+
+def plan_memory_budget(max_memory_mb, frame_bytes, num_workers=0, queue_depth=0):
+    # Splits the memory budget of an extraction between the decoded frames (one being decoded + `queue_depth`
+    # waiting for or being encoded), the copies made by the encoders of the workers, and the encoded files
+    # waiting to be written (at least a quarter of the budget). Returns the queue depth and the max bytes
+    # waiting to be written (DEFAULT_MAX_PENDING_BYTES without a budget). The decoder and the interpreter
+    # use memory outside this budget.
+    if queue_depth <= 0:
+        queue_depth = 2 * num_workers
+    if max_memory_mb <= 0:
+        return queue_depth, DEFAULT_MAX_PENDING_BYTES
+    budget = int(max_memory_mb * 1024 * 1024)
+    frame_bytes = max(1, frame_bytes)
+    if num_workers > 0:
+        max_queue_depth = (budget - max(frame_bytes, budget // 4)) // frame_bytes - 1 - num_workers
+        queue_depth = max(1, min(queue_depth, max_queue_depth))
+        frames_bytes = (1 + queue_depth + num_workers) * frame_bytes
+    else:
+        frames_bytes = frame_bytes
+    if frames_bytes + frame_bytes > budget:
+        print(f"    --max-memory {max_memory_mb:g} MB is too small for {frame_bytes / (1024*1024):.1f} MB frames, using {(frames_bytes + frame_bytes) / (1024*1024):.0f} MB")
+    return queue_depth, max(frame_bytes, budget - frames_bytes)
+
+
+def add_frame_index_row(frame_index, idx_frame, timestamp, frame_stats, frame_writer, frame_outputs, encoded_frames):
+    frame_index.add(idx_frame, timestamp, frame_stats, {get_output_key(frame_output): (location, len(encoded)) for frame_output, location, encoded
+                                                        in zip(frame_outputs, frame_writer.last_locations, encoded_frames)})
+
+
+def extract_frames_pipelined(frame_source, frame_writer, frame_outputs, num_frames_video, num_workers=4, queue_depth=0, use_processes=False, progress=ignore_progress, on_frame_done=None, metrics=None, frame_index=None):
+    # The calling thread decodes frames and writes the encoded outputs in frame order, a pool of workers encodes them.
+    # At most `queue_depth` frames are in flight, decoded into `queue_depth + 1` reused buffers (shared memory
+    # for a process pool), which bounds memory usage.
+    if queue_depth <= 0:
+        queue_depth = 2 * num_workers
+    in_flight = collections.deque()
+    buffer_pool = FrameBufferPool(queue_depth + 1, shared=use_processes)
+    num_saved = 0
+    bytes_written = 0
+
+    def write_oldest_frame():
+        nonlocal bytes_written
+        idx_frame, timestamp, future, idx_buffer = in_flight.popleft()
+        if future is not None:
+            encoded_frames, stage_seconds, frame_stats = future.result()
+            buffer_pool.release(idx_buffer)
+            add_encode_metrics(metrics, stage_seconds)
+            start = time.perf_counter()
+            bytes_written += frame_writer.write(idx_frame, frame_outputs, encoded_frames)
+            metrics.add('write', time.perf_counter() - start)
+            if frame_index is not None:
+                add_frame_index_row(frame_index, idx_frame, timestamp, frame_stats, frame_writer, frame_outputs, encoded_frames)
+        if on_frame_done is not None:
+            on_frame_done(idx_frame)
+
+    executor_class = concurrent.futures.ProcessPoolExecutor if use_processes else concurrent.futures.ThreadPoolExecutor
+    start_time = time.perf_counter()
+    try:
+        with executor_class(max_workers=num_workers) as executor:
+            while True:
+                idx_buffer = buffer_pool.acquire()
+                item = frame_source.read(buffer_pool.get(idx_buffer))
+                frame = item[2] if item is not None else None
+                if frame is None or frame is not buffer_pool.get(idx_buffer):
+                    buffer_pool.release(idx_buffer)
+                    idx_buffer = buffer_pool.store(frame) if frame is not None else None
+                if item is None:
+                    break
+                idx_frame, timestamp = item[:2]
+
+                if frame is None:
+                    in_flight.append((idx_frame, timestamp, None, None))
+                elif use_processes and idx_buffer is not None:
+                    in_flight.append((idx_frame, timestamp, executor.submit(encode_shared_frame_outputs, buffer_pool.get_block_name(idx_buffer),
+                                                                            frame.shape, frame.dtype.str, frame_outputs, frame_index is not None), idx_buffer))
+                else:
+                    in_flight.append((idx_frame, timestamp, executor.submit(encode_frame_outputs, frame, frame_outputs, frame_index is not None), idx_buffer))
+                if frame is not None:
+                    num_saved += 1
+                    fps = (idx_frame - frame_source.first_frame + 1) / (time.perf_counter() - start_time)
+                    progress(f"    Decoding frame {idx_frame}/{num_frames_video} ({fps:.1f} fps, {len(in_flight)} in flight): {frame_writer.last_location}")
+                metrics.sample_queue('encode', len(in_flight))
+                metrics.sample_queue('write', frame_writer.pending_writes())
+                while len(in_flight) > 0 and (len(in_flight) > queue_depth or in_flight[0][2] is None or in_flight[0][2].done()):
+                    write_oldest_frame()
+
+            while len(in_flight) > 0:
+                write_oldest_frame()
+    finally:
+        buffer_pool.close()
+    return frame_source.next_frame - frame_source.first_frame, num_saved, bytes_written
+
+
+def extract_frame_range(frame_source, frame_writer, frame_outputs, num_frames_video=0, num_workers=0, queue_depth=0, use_processes=False, progress=ignore_progress, on_frame_done=None, metrics=None, frame_index=None):
+    # Encodes the frames of a FrameSource (its range and selection) for every output and writes them to `frame_writer`.
+    # `on_frame_done(idx_frame)` is called once all the outputs of a frame are written, or when it is skipped.
+    # A row is added to `frame_index` for every frame written.
+    # Returns the number of frames read, the number of frames saved and the bytes written.
+    if metrics is None:
+        metrics = frame_source.metrics if frame_source.metrics is not None else StageMetrics()
+    frame_source.metrics = metrics
+    if num_frames_video <= 0:
+        num_frames_video = frame_source.metadata.frame_count
+
+    if num_workers > 0:
+        return extract_frames_pipelined(frame_source, frame_writer, frame_outputs, num_frames_video,
+                                        num_workers, queue_depth, use_processes, progress, on_frame_done, metrics, frame_index)
+
+    num_saved = 0
+    bytes_written = 0
+    buffer = None   # every frame is decoded into the array of the first one
+    start_time = time.perf_counter()
+    while True:
+        item = frame_source.read(buffer)
+        if item is None:
+            break
+        idx_frame, timestamp, frame = item
+
+        if frame is not None:
+            buffer = frame
+            encoded_frames, stage_seconds, frame_stats = encode_frame_outputs(frame, frame_outputs, frame_index is not None)
+            add_encode_metrics(metrics, stage_seconds)
+            start = time.perf_counter()
+            bytes_written += frame_writer.write(idx_frame, frame_outputs, encoded_frames)
+            metrics.add('write', time.perf_counter() - start)
+            if frame_index is not None:
+                add_frame_index_row(frame_index, idx_frame, timestamp, frame_stats, frame_writer, frame_outputs, encoded_frames)
+            metrics.sample_queue('write', frame_writer.pending_writes())
+            fps = (idx_frame - frame_source.first_frame + 1) / (time.perf_counter() - start_time)
+            progress(f"    Saving frame {idx_frame}/{num_frames_video} ({fps:.1f} fps): {frame_writer.last_location}")
+            num_saved += 1
+        if on_frame_done is not None:
+            on_frame_done(idx_frame)
+    return frame_source.next_frame - frame_source.first_frame, num_saved, bytes_written
+
+
+def split_frame_range(start_frame, end_frame, num_segments, keyframes=None):
+    # Splits [start_frame, end_frame) into up to `num_segments` contiguous ranges of similar size,
+    # moving every boundary to the nearest keyframe so no segment starts decoding mid-GOP
+    boundaries = [start_frame]
+    for idx_segment in range(1, num_segments):
+        boundary = start_frame + (end_frame - start_frame) * idx_segment // num_segments
+        if keyframes:
+            idx_keyframe = bisect.bisect_left(keyframes, boundary)
+            candidates = keyframes[max(0, idx_keyframe-1):idx_keyframe+1]
+            boundary = min(candidates, key=lambda keyframe: abs(keyframe - boundary))
+        if boundaries[-1] < boundary < end_frame:
+            boundaries.append(boundary)
+    boundaries.append(end_frame)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def extract_segment_job(video_path, frames_path, video_name, frame_outputs, num_frames_video, start_frame, end_frame,
+                        num_workers, queue_depth, use_processes, frame_selector, message_queue, idx_segment, max_pending_bytes=DEFAULT_MAX_PENDING_BYTES, with_frame_index=False):
+    metrics = StageMetrics()
+    frame_index = FrameIndex() if with_frame_index else None
+    frame_source = FrameSource(video_path, start_frame, end_frame, frame_selector, metrics=metrics)
+    frame_writer = FileFrameWriter(frames_path, video_name, max_pending_bytes)
+    watermark = FrameWatermark(start_frame)
+    progress = ThrottledProgress(lambda text: message_queue.put(('progress', f'    [segment {idx_segment}] {text.strip()}')), 10)
+    last_message = [0.0]
+
+    def on_frame_done(idx_frame):
+        last_frame = watermark.add(idx_frame)
+        if time.time() - last_message[0] >= 1.0:
+            # the parent saves the watermark in the manifest, so the files of the frames must be written first,
+            # and the frame index rows up to it go with the watermark
+            last_frame = frame_writer.checkpoint(last_frame)
+            rows = None
+            if frame_index is not None:
+                rows = {idx_row: frame_index.rows.pop(idx_row) for idx_row in [idx_row for idx_row in frame_index.rows if idx_row <= last_frame]}
+            message_queue.put(('watermark', idx_segment, last_frame, rows))
+            last_message[0] = time.time()
+
+    try:
+        result = extract_frame_range(frame_source, frame_writer, frame_outputs, num_frames_video,
+                                     num_workers, queue_depth, use_processes, progress, on_frame_done, metrics, frame_index)
+    finally:
+        frame_source.close()
+        frame_writer.close(metrics)
+    return result + (metrics.as_dict(), frame_index.rows if frame_index is not None else None)
+
+
+def extract_segments_parallel(video_path, frames_path, video_name, frame_outputs, num_frames_video, num_segments, start_frame=0, end_frame=-1,
+                              num_workers=0, queue_depth=0, use_processes=False, progress=ignore_progress, checkpoint=None, frame_selector=None, metrics=None,
+                              max_pending_bytes=DEFAULT_MAX_PENDING_BYTES, frame_index=None):
+    # Splits the video at keyframes and decodes every segment with its own VideoCapture in a separate
+    # process. Frames keep their global index, so the output is the same as a sequential run
+    # (except with the scene-change selection, which restarts its comparison at every segment).
+    keyframes = get_keyframe_indices(video_path)
+    if keyframes is None:
+        print('    Keyframe index not available, splitting the video at evenly spaced frames')
+    split_end_frame = end_frame if end_frame >= 0 else num_frames_video
+    segments = split_frame_range(start_frame, max(start_frame + 1, split_end_frame), num_segments, keyframes)
+    if end_frame < 0:
+        segments[-1] = (segments[-1][0], -1)   # the container frame count may be inaccurate, read the last segment to the end
+    print(f"    Decoding {len(segments)} segments starting at frames {', '.join(str(start) for start, end in segments)}")
+
+    manager = multiprocessing.Manager()
+    message_queue = manager.Queue()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=len(segments)) as executor:
+            futures = [executor.submit(extract_segment_job, video_path, frames_path, video_name, frame_outputs, num_frames_video,
+                                       segment_start, segment_end, num_workers, queue_depth, use_processes, frame_selector,
+                                       message_queue, idx_segment, max_pending_bytes, frame_index is not None)
+                       for idx_segment, (segment_start, segment_end) in enumerate(segments)]
+            # frames are done contiguously up to the watermark of the first unfinished segment
+            segment_watermarks = [segment_start - 1 for segment_start, segment_end in segments]
+            while not all(future.done() for future in futures):
+                try:
+                    message = message_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if message[0] == 'progress':
+                    progress(message[1])
+                elif message[0] == 'watermark':
+                    if frame_index is not None:
+                        frame_index.merge(message[3])
+                    if checkpoint is not None:
+                        segment_watermarks[message[1]] = max(segment_watermarks[message[1]], message[2])
+                        for future, (segment_start, segment_end), segment_watermark in zip(futures, segments, segment_watermarks):
+                            if not future.done() or future.exception() is not None:
+                                checkpoint.update(segment_watermark)
+                                break
+            results = [future.result() for future in futures]
+    finally:
+        manager.shutdown()
+    for result in results:
+        if metrics is not None:
+            metrics.merge(result[3])
+        if frame_index is not None:
+            frame_index.merge(result[4])
+    return tuple(sum(result[idx] for result in results) for idx in range(3))
+
+
+def verify_extracted_frames(video_path, frames_path, frame_outputs, frame_selection, progress=ignore_progress):
+    # Decodes the video sequentially and checks that every extracted file is byte-identical to the
+    # file a sequential run would have written. Returns the paths that differ or are missing.
+    video_name, video_ext = os.path.splitext(os.path.basename(video_path))
+    mismatches = []
+    frame_selector = FrameSelector(get_video_metadata(video_path).fps, **frame_selection)
+    with FrameSource(video_path, frame_selector=frame_selector, reuse_buffer=True) as frame_source:
+        for idx_frame, timestamp, frame in frame_source:
+            frame_paths = get_frame_paths(frames_path, video_name, idx_frame, frame_outputs)
+            for (frame_path, frame_qual), encoded in zip(frame_paths, encode_frame_outputs(frame, frame_outputs)[0]):
+                progress(f"    Verifying frame {idx_frame}: {frame_path}")
+                if not os.path.isfile(frame_path):
+                    mismatches.append(frame_path)
+                    continue
+                with open(frame_path, 'rb') as frame_file:
+                    if frame_file.read() != encoded:
+                        mismatches.append(frame_path)
+    return mismatches
+
+
+def extract_all_frames_from_video(video_path='', frames_path='', frame_exts=['png','jpg'], frame_quality=95, num_workers=0, queue_depth=0, use_processes=False, num_segments=1, verify_segments=False, force=False, frame_selection=None, output_backend='files', shard_size_mb=1024, encoder_options=None, frame_transform=None, from_selection=False, dedup_index_path='', max_memory_mb=0, frame_index_formats=('npz',), progress=print_progress, progress_hz=4.0):
+    frame_exts = [ext.lower().strip('.') for ext in frame_exts]
+    
+    if not type(frame_quality) is list:
+        frame_quality = [frame_quality]
+    frame_quality = [int(frame_qual) for frame_qual in frame_quality]
+    requested_outputs = get_frame_outputs(frame_exts, frame_quality, encoder_options, frame_transform)
+    if frame_selection is None:
+        frame_selection = get_frame_selection()
+
+    start_time = time.time()
+    video_name, video_ext = os.path.splitext(os.path.basename(video_path))
+    if from_selection:
+        selection = load_selection(video_path)
+        if selection is None:
+            print(f"    No selection file for {video_name} ({get_selection_path(video_path)}), skipping it")
+            return {'video': video_path, 'frames': 0, 'saved': 0, 'bytes': 0, 'seconds': time.time() - start_time, **StageMetrics().as_dict()}
+        frame_selection = {**frame_selection, 'frame_ranges': get_selection_ranges(selection)}
+    manifest, frame_outputs, start_frame = plan_extraction_resume(frames_path, video_path, requested_outputs, frame_selection, force)
+    if len(frame_outputs) == 0:
+        print(f"    {video_name} already extracted, skipping it (use --force to extract it again)")
+        return {'video': video_path, 'frames': 0, 'saved': 0, 'bytes': 0, 'seconds': time.time() - start_time, **StageMetrics().as_dict()}
+    if output_backend == 'shards':
+        # a shard holds every output of its frames: the shards written again from start_frame get all the
+        # requested outputs, and the outputs not requested any more lose their frames from start_frame
+        frame_outputs = requested_outputs
+        requested_keys = [get_output_key(frame_output) for frame_output in requested_outputs]
+        for output_key, output_state in manifest['outputs'].items():
+            if output_key not in requested_keys and output_state['last_frame'] >= start_frame:
+                output_state.update(last_frame=start_frame - 1, complete=False)
+    progress = ThrottledProgress(progress, progress_hz)
+    metrics = StageMetrics()
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        # a truncated or unreadable clip doesn't stop the extraction of the other videos
+        print(f"    Unable to open video file {video_path}, skipping it")
+        return {'video': video_path, 'frames': 0, 'saved': 0, 'bytes': 0, 'seconds': time.time() - start_time, 'error': 'unable to open the video',
+                **StageMetrics().as_dict()}
+    num_frames_video, width, height, fps = count_num_frames_video(video_path, verbose=True, cap=cap)
+    try:
+        check_frame_transform(frame_transform, width, height)   # before any frame, index or manifest is written
+    except Exception:
+        cap.release()
+        raise
+    frame_selector = FrameSelector(fps, **frame_selection)
+    end_frame = frame_selector.end_frame
+    resuming = start_frame > frame_selector.start_frame
+    start_frame = max(start_frame, frame_selector.start_frame)
+    if num_segments > 1 and output_backend != 'files':
+        print(f"    --segments is only supported with the files output backend, decoding {video_name} sequentially")
+        num_segments = 1
+    if 'dedup' in frame_selection:
+        if num_segments > 1:
+            print(f"    --segments is not supported with --dedup-hash (the frames are compared in order), decoding {video_name} sequentially")
+            num_segments = 1
+        if not dedup_index_path:
+            dedup_index_path = os.path.join(os.path.dirname(os.path.abspath(frames_path)), 'dedup_index.npz')
+        frame_selector.dedup_index = DedupIndex(dedup_index_path, video_name, resume=resuming, start_frame=start_frame, **frame_selection['dedup'])
+    # the segment processes share the budget
+    queue_depth, max_pending_bytes = plan_memory_budget(max_memory_mb / num_segments, width * height * 3, num_workers, queue_depth)
+    if max_memory_mb > 0:
+        print(f"    Memory budget {max_memory_mb:g} MB: {queue_depth if num_workers > 0 else 0} frames in flight{' per segment' if num_segments > 1 else ''}, "
+              f"{max_pending_bytes / (1024*1024):.1f} MB of frames waiting to be written")
+    frame_index = None
+    if len(frame_index_formats) > 0:
+        # the rows of a previous run of the same selection keep the frames and outputs not extracted again
+        frame_index = FrameIndex.load(frames_path, video_name) if len(manifest['outputs']) > 0 else FrameIndex()
+        frame_index.video_start_time = get_video_start_time(video_path, num_frames_video / fps if fps > 0 else 0.0)
+    frame_writer = create_frame_writer(output_backend, frames_path, video_name, frame_outputs, start_frame, shard_size_mb, max_pending_bytes, manifest)
+
+    def save_checkpoint_state(last_frame):
+        # the dedup hashes and the frame index rows of the frames up to the manifest checkpoint
+        if frame_selector.dedup_index is not None:
+            frame_selector.dedup_index.save(last_frame)
+        if frame_index is not None:
+            frame_index.save(frames_path, video_name, frame_index_formats, last_frame)
+
+    checkpoint = ManifestCheckpoint(frames_path, manifest, frame_outputs, start_frame, frame_writer=frame_writer, on_save=save_checkpoint_state)
+    checkpoint.update(start_frame - 1, force_save=True)   # the outputs written again are not complete any more, even if the run is killed now
+
+    print(f"    Processing {video_name} ({width}x{height}, {int(fps)} FPS)...")
+    if resuming:
+        print(f"    Resuming from frame {start_frame}, outputs: {', '.join(checkpoint.output_keys)}")
+
+    if num_segments > 1:
+        cap.release()
+        frame_writer.close()   # the segment processes write the frames and flush them before sending their watermarks
+        checkpoint.frame_writer = None
+        num_frames, num_saved, bytes_written = extract_segments_parallel(video_path, frames_path, video_name, frame_outputs, num_frames_video,
+                                                                         num_segments, start_frame, end_frame, num_workers, queue_depth,
+                                                                         use_processes, progress, checkpoint, frame_selector, metrics,
+                                                                         max_pending_bytes, frame_index)
+    else:
+        try:
+            frame_source = FrameSource(video_path, start_frame, end_frame, frame_selector, cap=cap, metrics=metrics)
+            num_frames, num_saved, bytes_written = extract_frame_range(frame_source, frame_writer, frame_outputs, num_frames_video,
+                                                                       num_workers, queue_depth, use_processes,
+                                                                       progress, checkpoint.frame_done, metrics, frame_index)
+        finally:
+            cap.release()
+            frame_writer.close(metrics)
+    if start_frame + num_frames > 0:
+        checkpoint.finish(start_frame + num_frames - 1)
+    print(f"Extracted {num_saved} of {num_frames} frames read from {video_name}.")
+    if frame_selector.dedup_index is not None:
+        print(f"    Skipped {frame_selector.dedup_index.num_duplicates} near-duplicate frames ({frame_selector.dedup_index.index_path})")
+    print(f"    Stages: {metrics.summary()}")
+
+    if num_segments > 1 and verify_segments and frame_selection['scene_threshold'] > 0:
+        print(f"    Not verifying {video_name}: the scene-change selection restarts at every segment")
+    elif num_segments > 1 and verify_segments:
+        mismatches = verify_extracted_frames(video_path, frames_path, frame_outputs, frame_selection, progress)
+        if len(mismatches) > 0:
+            raise Exception(f'{len(mismatches)} frames of {video_name} differ from a sequential extraction, first one: {mismatches[0]}')
+        print(f"    Verified: segmented output of {video_name} is byte-identical to a sequential extraction.")
+    return {'video': video_path, 'frames': num_frames, 'saved': num_saved, 'bytes': bytes_written, 'seconds': time.time() - start_time,
+            **metrics.as_dict()}
+
+
+def plan_cpu_budget(num_videos, num_jobs, num_workers, cpu_budget):
+    # Every video job uses one decoding core plus `num_workers` encoder/writer cores.
+    # Shrink the per-video pool first, then the number of videos, until both fit in the budget.
+    cpu_budget = max(1, cpu_budget)
+    if num_jobs <= 0:
+        num_jobs = max(1, cpu_budget // (1 + num_workers))
+    num_jobs = max(1, min(num_jobs, num_videos, cpu_budget))
+    if num_jobs * (1 + num_workers) > cpu_budget:
+        num_workers = max(0, cpu_budget // num_jobs - 1)
+    return num_jobs, num_workers
+
+
+def get_sort_frame_count(path_video):
+    # frame count used to start the longest videos first, 0 for the videos that can't be opened
+    # (sorted last, their job reports them)
+    try:
+        return get_video_metadata(path_video).frame_count
+    except Exception:
+        return 0
+
+
+def extract_video_job(path_video, frame_video_folder, extraction_kwargs, message_queue, free_slots):
+    slot = free_slots.get()
+    video_name = os.path.basename(path_video)
+
+    def progress(text):
+        message_queue.put((slot, f'[{video_name}] {text.strip()}'))
+
+    try:
+        # silence the per-video prints, the parent process renders one line per slot
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            stats = extract_all_frames_from_video(path_video, frame_video_folder, progress=progress, **extraction_kwargs)
+        if 'error' in stats:
+            message_queue.put((slot, f'[{video_name}] skipped: {stats["error"]}'))
+        else:
+            message_queue.put((slot, f'[{video_name}] done: {stats["saved"]}/{stats["frames"]} frames in {stats["seconds"]:.1f}s'))
+        return stats
+    finally:
+        free_slots.put(slot)
+
+
+def extract_videos_parallel(paths_videos, frame_folder, extraction_kwargs, num_jobs, metrics_writer=None):
+    # Extracts `num_jobs` videos at once, each one in its own process
+    manager = multiprocessing.Manager()
+    message_queue = manager.Queue()
+    free_slots = manager.Queue()
+    for slot in range(num_jobs):
+        free_slots.put(slot)
+
+    progress_display = MultiLineProgress(message_queue, num_jobs)
+    progress_display.start()
+    all_stats = []
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_jobs) as executor:
+            futures = []
+            # longest videos first, so a long video started last doesn't keep a single job running at the end
+            for path_video in sorted(paths_videos, key=lambda path: -get_sort_frame_count(path)):
+                video_name, video_ext = os.path.splitext(os.path.basename(path_video))
+                frame_video_folder = os.path.join(frame_folder, video_name)
+                os.makedirs(frame_video_folder, exist_ok=True)
+                futures.append(executor.submit(extract_video_job, path_video, frame_video_folder,
+                                               extraction_kwargs, message_queue, free_slots))
+            for future in concurrent.futures.as_completed(futures):
+                all_stats.append(future.result())
+                if metrics_writer is not None:
+                    metrics_writer.add_video(all_stats[-1])
+    finally:
+        progress_display.stop()
+        manager.shutdown()
+    return all_stats
@@ -0,0 +1,133 @@
+# Video files of the dataset folders: scanning the folder trees, the timestamp names given to the videos
+# (FIMI0001.MP4 -> FIMI0001_2024-09-22_15-30-25_height=9m.MP4, from the mtime of the file) and the
+# deletes and renames planned by 0_preprocess_videos_fimix8tele.py.
+
+import os, sys
+import re
+import functools
+import collections
+import concurrent.futures
+from datetime import datetime
+
+
+def find_files_with_extensions(folder_path, valid_extensions):
+    return sorted(entry.path for entry in scan_folder(folder_path, valid_extensions))
+
+
+def scan_folder(folder_path, extensions):
+    # Single walk of the tree with os.scandir, yields the DirEntry of the files with one of the extensions.
+    # The DirEntry objects keep the file type from the directory listing and cache their stat().
+    extensions = tuple(ext.lower() for ext in extensions)
+    folders = [folder_path]
+    while len(folders) > 0:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif entry.name.lower().endswith(extensions) and entry.is_file():
+                    yield entry
+
+
+def timeConvert(timestamp):
+    newtime = datetime.fromtimestamp(timestamp)
+    date_str = str(newtime.date())
+    time_str = str(newtime.time()).split('.')[0].replace(':','-')
+    return date_str, time_str
+
+
+@functools.lru_cache(maxsize=None)
+def get_formatted_name_pattern(suffix=''):
+    return re.compile(r'\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}.'+suffix)
+
+
+def filename_is_already_formatted(pathfile, suffix=''):
+    filename = os.path.basename(pathfile)
+    return bool(get_formatted_name_pattern(suffix).search(filename))
+
+
+def get_new_filename(filename, mtime, suffix=''):
+    mdate_str, mtime_str = timeConvert(mtime)
+    name, extension = os.path.splitext(filename)
+    return name.split('_')[0] + '_' + mdate_str + '_' + mtime_str + ('_' + suffix if suffix != '' else '') + extension
+
+
+def get_filename_time(filename):
+    # Seconds since the epoch of the timestamp put in the name by get_new_filename(), None if there is none
+    match = re.search(r'(\d{4}-\d{2}-\d{2})_(\d{2}-\d{2}-\d{2})', filename)
+    if match is None:
+        return None
+    return datetime.strptime(f'{match.group(1)} {match.group(2)}', '%Y-%m-%d %H-%M-%S').timestamp()
+
+
+def build_preprocess_plan(folder_path, delete_exts, valid_exts, suffix='', force=False, companion_exts=()):
+    # Scans the tree once and returns the files to delete, the (path, new path) renames and the
+    # renames skipped because the new name is taken by another file or by another rename.
+    # The companion files kept (FIMI0001.LRV of FIMI0001.MP4) get the new name of their video, and keep
+    # their name when their video can't be renamed, so a proxy never pairs with another video.
+    paths_to_delete = []
+    entries_valid = []
+    companions = collections.defaultdict(list)
+    names_by_folder = collections.defaultdict(set)
+    for entry in scan_folder(folder_path, list(delete_exts) + list(valid_exts) + list(companion_exts)):
+        names_by_folder[os.path.dirname(entry.path)].add(entry.name)
+        if entry.name.endswith(tuple(delete_exts)) and not entry.name.endswith(tuple(valid_exts)):
+            paths_to_delete.append(entry.path)
+        elif entry.name.lower().endswith(tuple(ext.lower() for ext in valid_exts)):
+            entries_valid.append(entry)
+        else:
+            companions[os.path.splitext(entry.path)[0]].append(entry.path)
+    for path_file in paths_to_delete:
+        names_by_folder[os.path.dirname(path_file)].discard(os.path.basename(path_file))
+
+    renames = []
+    collisions = []
+    new_paths = set()
+    for entry in sorted(entries_valid, key=lambda entry: entry.path):
+        if filename_is_already_formatted(entry.name, suffix) and not force:
+            continue
+        new_name = get_new_filename(entry.name, entry.stat().st_mtime, suffix)
+        if new_name == entry.name:
+            continue
+        new_path = os.path.join(os.path.dirname(entry.path), new_name)
+        file_renames = [(entry.path, new_path)] + [(path_companion, os.path.splitext(new_path)[0] + os.path.splitext(path_companion)[1])
+                                                   for path_companion in companions[os.path.splitext(entry.path)[0]]]
+        for path_file, new_path in file_renames:
+            if new_path in new_paths or os.path.basename(new_path) in names_by_folder[os.path.dirname(path_file)]:
+                collisions.append((path_file, new_path))
+                if path_file == entry.path:
+                    break
+            else:
+                new_paths.add(new_path)
+                renames.append((path_file, new_path))
+    num_valid_renamed = sum(1 for path_file, new_path in renames + collisions if path_file.lower().endswith(tuple(ext.lower() for ext in valid_exts)))
+    return {'delete': sorted(paths_to_delete), 'rename': renames, 'collisions': collisions, 'num_valid': len(entries_valid), 'num_valid_renamed': num_valid_renamed}
+
+
+def print_preprocess_plan(plan):
+    for path_file in plan['delete']:
+        print(f'DELETE {path_file}')
+    for path_file, new_path in plan['rename']:
+        print(f'RENAME {path_file}')
+        print(f'   └─> {os.path.basename(new_path)}')
+    for path_file, new_path in plan['collisions']:
+        print(f'SKIP   {path_file}: {os.path.basename(new_path)} already exists or is the new name of another file')
+    print(f"{len(plan['delete'])} files to delete, {len(plan['rename'])} files to rename, {len(plan['collisions'])} name collisions")
+
+
+def apply_preprocess_plan(plan, num_threads=8):
+    # Deletes first, so the new names can't collide with files being removed. On high-latency
+    # (network) filesystems most of the time is waiting for the server, so the calls run in threads.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, num_threads)) as executor:
+        futures = [executor.submit(os.remove, path_file) for path_file in plan['delete']]
+        for idx_file, future in enumerate(concurrent.futures.as_completed(futures)):
+            future.result()
+            print(f'DELETING FILE {idx_file}/{len(plan["delete"])}', end='\r')
+        if len(plan['delete']) > 0:
+            print('')
+
+        futures = {executor.submit(os.rename, path_file, new_path): (path_file, new_path) for path_file, new_path in plan['rename']}
+        for idx_file, future in enumerate(concurrent.futures.as_completed(futures)):
+            future.result()
+            path_file, new_path = futures[future]
+            print(f'RENAMING FILE {idx_file}/{len(plan["rename"])}: {path_file}')
+            print(f'              └─> {os.path.basename(new_path)}')
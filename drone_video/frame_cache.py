@@ -0,0 +1,192 @@
+# Random access to the decoded frames of a video for the interactive players: recently decoded frames
+# are kept in LRU order up to a memory budget, a background thread decodes the next frames ahead of the
+# playback and seeks start decoding at the nearest keyframe, keeping the frames decoded on the way.
+
+import os, sys
+import cv2
+import bisect
+import threading
+import collections
+
+from .video_metadata import get_video_metadata, get_keyframe_indices
+
+
+class FrameCache:
+    def __init__(self, video_path, max_memory_mb=512, read_ahead=16):
+        self.video_path = video_path
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise Exception(f"Error: Unable to open video file: {video_path}")
+        self.metadata = get_video_metadata(video_path, self.cap)
+        self.max_bytes = max_memory_mb * 1024 * 1024
+        self.capacity = max(2, self.max_bytes // max(1, self.metadata.width * self.metadata.height * 3))   # frames
+        self.read_ahead = min(read_ahead, self.capacity // 2)
+        self.frames = collections.OrderedDict()
+        self.num_bytes = 0
+        self.next_decoded = 0   # index of the frame returned by the next cap.read()
+        self.position = 0       # last frame requested
+        self.hits = 0
+        self.misses = 0
+        self.keyframes = None   # loaded in background, seeks use CAP_PROP_POS_FRAMES until then
+
+        self.lock = threading.Lock()   # protects self.cap and self.frames
+        self.wake_up = threading.Event()
+        self.stopped = False
+        threading.Thread(target=self.load_keyframes, daemon=True).start()
+        self.thread = threading.Thread(target=self.read_ahead_frames, daemon=True)
+        self.thread.start()
+
+    def load_keyframes(self):
+        self.keyframes = get_keyframe_indices(self.video_path)
+
+    def get_keyframe(self, idx_frame):
+        if not self.keyframes:
+            return None
+        return self.keyframes[max(0, bisect.bisect_right(self.keyframes, idx_frame) - 1)]
+
+    def add_frame(self, idx_frame, frame):
+        if idx_frame in self.frames:
+            self.frames.move_to_end(idx_frame)
+            return
+        self.frames[idx_frame] = frame
+        self.num_bytes += frame.nbytes
+        while self.num_bytes > self.max_bytes and len(self.frames) > 1:
+            old_idx, old_frame = self.frames.popitem(last=False)
+            self.num_bytes -= old_frame.nbytes
+
+    def seek(self, idx_frame):
+        # Moves the decoder so the next read returns `idx_frame`. Keeps decoding forward when `idx_frame` is
+        # in the same GOP ahead, otherwise restarts at its keyframe and caches the last frames decoded until it.
+        keyframe = self.get_keyframe(idx_frame)
+        if self.next_decoded <= idx_frame and (self.next_decoded >= (keyframe if keyframe is not None else idx_frame - self.read_ahead)):
+            pass
+        elif keyframe is not None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+            self.next_decoded = keyframe
+        else:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, idx_frame)
+            self.next_decoded = idx_frame
+            return
+
+        first_cached = idx_frame - self.capacity // 2
+        while self.next_decoded < idx_frame:
+            if self.next_decoded >= first_cached and self.next_decoded not in self.frames:
+                ret, frame = self.cap.read()
+                if ret:
+                    self.add_frame(self.next_decoded, frame)
+            else:
+                ret = self.cap.grab()
+            if not ret:
+                break
+            self.next_decoded += 1
+
+    def read_next(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        self.add_frame(self.next_decoded, frame)
+        self.next_decoded += 1
+        return frame
+
+    def get(self, idx_frame):
+        # Returns the frame or None after the end of the video
+        idx_frame = max(0, idx_frame)
+        with self.lock:
+            self.position = idx_frame
+            if idx_frame in self.frames:
+                self.hits += 1
+                self.frames.move_to_end(idx_frame)
+                frame = self.frames[idx_frame]
+            else:
+                self.misses += 1
+                if self.next_decoded != idx_frame:
+                    self.seek(idx_frame)
+                frame = self.read_next()
+        self.wake_up.set()
+        return frame
+
+    def read_ahead_frames(self):
+        while not self.stopped:
+            self.wake_up.wait()
+            self.wake_up.clear()
+            while not self.stopped and not self.wake_up.is_set():
+                # one frame per lock acquisition, so get() never waits more than one decode
+                with self.lock:
+                    missing = [idx for idx in range(self.position + 1, min(self.position + self.read_ahead, self.metadata.frame_count - 1) + 1)
+                               if idx not in self.frames]
+                    if len(missing) == 0:
+                        break
+                    if self.next_decoded != missing[0]:
+                        self.seek(missing[0])
+                    if self.read_next() is None:
+                        break
+
+    def status(self):
+        return f'cache {len(self.frames)} frames {self.num_bytes / (1024*1024):.0f}/{self.max_bytes / (1024*1024):.0f} MB, {self.hits} hits {self.misses} misses'
+
+    def close(self):
+        self.stopped = True
+        self.wake_up.set()
+        self.thread.join()
+        self.cap.release()
+
+
+def find_proxy_video(video_path, proxy_exts=('LRV', 'lrv')):
+    # Low resolution copy recorded by the drone next to the video (FIMI0001.MP4 -> FIMI0001.LRV)
+    video_stem = os.path.splitext(video_path)[0]
+    for proxy_ext in proxy_exts:
+        if os.path.isfile(f'{video_stem}.{proxy_ext}'):
+            return f'{video_stem}.{proxy_ext}'
+    return None
+
+
+class PreviewFrames:
+    # Frames shown by the players, indexed by the frames of the full resolution video.
+    # preview='lrv' shows the LRV proxy, 'scale' the video frames scaled to `preview_width`, 'auto' the LRV
+    # proxy if there is one and the scaled frames otherwise, and 'off' the full resolution frames.
+    # get_full() always decodes the exact full resolution frame (for saving it).
+    def __init__(self, video_path, preview='off', preview_width=1280, cache_mb=512, read_ahead=16):
+        self.video_path = video_path
+        self.preview_width = preview_width
+        proxy_path = find_proxy_video(video_path) if preview in ('lrv', 'auto') else None
+        if preview == 'lrv' and proxy_path is None:
+            print(f'    No LRV proxy found for {video_path}, previewing scaled frames')
+        self.preview = 'lrv' if proxy_path is not None else ('off' if preview == 'off' else 'scale')
+
+        if self.preview == 'lrv':
+            self.preview_cache = FrameCache(proxy_path, cache_mb, read_ahead)
+            self.full_cache = None   # opened at the first save
+            self.num_frames = get_video_metadata(video_path).frame_count
+        else:
+            self.preview_cache = FrameCache(video_path, cache_mb, read_ahead)
+            self.full_cache = self.preview_cache
+            self.num_frames = self.preview_cache.metadata.frame_count
+
+    def get_preview_index(self, idx_frame):
+        # the proxy covers the same time span, possibly with another number of frames
+        if self.preview != 'lrv':
+            return idx_frame
+        num_proxy_frames = self.preview_cache.metadata.frame_count
+        return min(num_proxy_frames - 1, round(idx_frame * num_proxy_frames / max(1, self.num_frames)))
+
+    def get(self, idx_frame):
+        if idx_frame >= self.num_frames > 0:
+            return None
+        frame = self.preview_cache.get(self.get_preview_index(idx_frame))
+        if frame is not None and self.preview == 'scale' and frame.shape[1] > self.preview_width:
+            scale = self.preview_width / frame.shape[1]
+            frame = cv2.resize(frame, (self.preview_width, round(frame.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+        return frame
+
+    def get_full(self, idx_frame):
+        if self.full_cache is None:
+            self.full_cache = FrameCache(self.video_path, max_memory_mb=0, read_ahead=0)
+        return self.full_cache.get(idx_frame)
+
+    def status(self):
+        return self.preview_cache.status()
+
+    def close(self):
+        self.preview_cache.close()
+        if self.full_cache is not None and self.full_cache is not self.preview_cache:
+            self.full_cache.close()
@@ -0,0 +1,197 @@
+# Per-frame index of an extraction: one row per saved frame with its index, presentation timestamp,
+# wall-clock time, the location and size of every output and quality stats (sharpness: variance of the
+# Laplacian, brightness: mean gray level), saved as columns in <video>.frame_index.npz and/or .csv in the
+# frames folder. Filtering the frames of a flight is then a query on the index instead of decoding images:
+#     python -m drone_video.frame_index /path/to/frames --start 15:30 --end 15:35 --min-sharpness 100
+
+import os, sys
+import cv2
+import csv
+import glob
+import time
+import argparse
+from datetime import datetime
+import numpy as np
+
+from .files import get_filename_time
+
+
+def compute_frame_stats(frame):
+    # (sharpness, brightness) of a BGR frame, low sharpness means a blurred frame
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    mean, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+    return float(std[0, 0] ** 2), float(cv2.mean(gray)[0])
+
+
+def get_video_start_time(video_path, duration):
+    # The camera closes the file at the end of the recording, so the timestamp in the name given by
+    # 0_preprocess_videos_fimix8tele.py (or the mtime of a file not renamed) is the end of the video
+    end_time = get_filename_time(os.path.basename(video_path))
+    if end_time is None:
+        end_time = os.stat(video_path).st_mtime
+    return end_time - duration
+
+
+def get_frame_index_path(frames_path, video_name, index_format='npz'):
+    return os.path.join(frames_path, f'{video_name}.frame_index.{index_format}')
+
+
+class FrameIndex:
+    # Rows by frame index: (pts, sharpness, brightness, {output key: (location, bytes)}). Rows added again for
+    # the same frame (resumed or re-extracted outputs) replace the previous values of their outputs only.
+    def __init__(self, video_start_time=0.0):
+        self.video_start_time = video_start_time
+        self.rows = {}
+
+    def add(self, idx_frame, pts, frame_stats, outputs):
+        sharpness, brightness = frame_stats if frame_stats is not None else (np.nan, np.nan)
+        previous_outputs = self.rows[idx_frame][3] if idx_frame in self.rows else {}
+        self.rows[idx_frame] = (pts, sharpness, brightness, {**previous_outputs, **outputs})
+
+    def merge(self, rows):
+        for idx_frame, (pts, sharpness, brightness, outputs) in rows.items():
+            self.add(idx_frame, pts, (sharpness, brightness), outputs)
+
+    def get_columns(self, last_frame=None):
+        frames = sorted(idx_frame for idx_frame in self.rows if last_frame is None or idx_frame <= last_frame)
+        output_keys = sorted({key for idx_frame in frames for key in self.rows[idx_frame][3]})
+        pts = np.array([self.rows[idx_frame][0] for idx_frame in frames], dtype=np.float64)
+        columns = {'frame': np.array(frames, dtype=np.int64),
+                   'pts': pts,
+                   'wall_time': self.video_start_time + pts,
+                   'sharpness': np.array([self.rows[idx_frame][1] for idx_frame in frames], dtype=np.float32),
+                   'brightness': np.array([self.rows[idx_frame][2] for idx_frame in frames], dtype=np.float32)}
+        for key in output_keys:
+            columns[f'path_{key}'] = np.array([self.rows[idx_frame][3].get(key, ('', -1))[0] for idx_frame in frames], dtype=str)
+            columns[f'bytes_{key}'] = np.array([self.rows[idx_frame][3].get(key, ('', -1))[1] for idx_frame in frames], dtype=np.int64)
+        return columns
+
+    def save(self, frames_path, video_name, index_formats=('npz',), last_frame=None):
+        # Written to a temporary file and renamed, like the manifest. With `last_frame` (manifest checkpoints),
+        # only the rows of the frames up to it are saved: a resumed run writes the next ones again.
+        columns = self.get_columns(last_frame)
+        for index_format in index_formats:
+            index_path = get_frame_index_path(frames_path, video_name, index_format)
+            if index_format == 'npz':
+                with open(index_path + '.tmp', 'wb') as index_file:
+                    np.savez(index_file, video_start_time=self.video_start_time, **columns)
+            else:
+                with open(index_path + '.tmp', 'w', newline='') as index_file:
+                    writer = csv.writer(index_file)
+                    writer.writerow(list(columns))
+                    writer.writerows(zip(*[column.tolist() for column in columns.values()]))
+            os.replace(index_path + '.tmp', index_path)
+
+    @classmethod
+    def load(cls, frames_path, video_name):
+        # previous index of a video, to resume it (empty if there is none)
+        index_path = get_frame_index_path(frames_path, video_name, 'npz')
+        if not os.path.isfile(index_path):
+            index_path = get_frame_index_path(frames_path, video_name, 'csv')
+        frame_index = cls()
+        if not os.path.isfile(index_path):
+            return frame_index
+        columns = load_frame_index(index_path)
+        output_keys = [name[len('path_'):] for name in columns if name.startswith('path_')]
+        for row in range(len(columns['frame'])):
+            outputs = {key: (str(columns[f'path_{key}'][row]), int(columns[f'bytes_{key}'][row])) for key in output_keys
+                       if columns[f'bytes_{key}'][row] >= 0}
+            frame_index.add(int(columns['frame'][row]), float(columns['pts'][row]),
+                            (float(columns['sharpness'][row]), float(columns['brightness'][row])), outputs)
+        return frame_index
+
+
+def load_frame_index(index_path):
+    # Columns of a .frame_index.npz or .csv file as NumPy arrays
+    if index_path.endswith('.npz'):
+        with np.load(index_path) as index:
+            return {name: index[name] for name in index.files if name != 'video_start_time'}
+    with open(index_path, 'r', newline='') as index_file:
+        rows = list(csv.reader(index_file))
+    columns = {}
+    for idx_column, name in enumerate(rows[0]):
+        values = [row[idx_column] for row in rows[1:]]
+        if name.startswith('path_'):
+            columns[name] = np.array(values, dtype=str)
+        elif name in ('frame',) or name.startswith('bytes_'):
+            columns[name] = np.array(values, dtype=np.int64)
+        else:
+            columns[name] = np.array(values, dtype=np.float64)
+    return columns
+
+
+def get_time_bound(value, wall_time):
+    # Seconds to compare with `wall_time`: a datetime, seconds since the epoch, 'YYYY-MM-DD HH:MM[:SS]' or
+    # 'HH:MM[:SS]' (time of the day, compared with the time of the day of the frames)
+    if isinstance(value, datetime):
+        return value.timestamp(), wall_time
+    if not isinstance(value, str):
+        return float(value), wall_time
+    for time_format in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d_%H-%M-%S'):
+        try:
+            return datetime.strptime(value, time_format).timestamp(), wall_time
+        except ValueError:
+            pass
+    parts = [int(part) for part in value.split(':')]
+    seconds_of_day = parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) > 2 else 0)
+    utc_offset = time.localtime(float(wall_time[0]) if len(wall_time) > 0 else None).tm_gmtoff
+    return seconds_of_day, (wall_time + utc_offset) % 86400
+
+
+def query_frame_index(columns, start=None, end=None, min_sharpness=None, min_brightness=None, max_brightness=None):
+    # Rows of the index with start <= wall-clock time < end and the quality stats in the given bounds,
+    # as the same columns filtered
+    mask = np.ones(len(columns['frame']), dtype=bool)
+    if start is not None:
+        bound, times = get_time_bound(start, columns['wall_time'])
+        mask &= times >= bound
+    if end is not None:
+        bound, times = get_time_bound(end, columns['wall_time'])
+        mask &= times < bound
+    if min_sharpness is not None:
+        mask &= columns['sharpness'] >= min_sharpness
+    if min_brightness is not None:
+        mask &= columns['brightness'] >= min_brightness
+    if max_brightness is not None:
+        mask &= columns['brightness'] <= max_brightness
+    return {name: column[mask] for name, column in columns.items()}
+
+
+def find_frames(frames_folder, output_key=None, **query):
+    # Queries the frame indexes of a folder tree (.npz, or .csv when there is no .npz),
+    # returns (output location, frame index, wall-clock time, sharpness) tuples sorted by time
+    index_paths = glob.glob(os.path.join(frames_folder, '**', '*.frame_index.npz'), recursive=True)
+    index_paths += [index_path for index_path in glob.glob(os.path.join(frames_folder, '**', '*.frame_index.csv'), recursive=True)
+                    if index_path[:-len('csv')] + 'npz' not in index_paths]
+    frames = []
+    for index_path in index_paths:
+        columns = query_frame_index(load_frame_index(index_path), **query)
+        path_columns = [name for name in columns if name.startswith('path_') and (output_key is None or name == f'path_{output_key}')]
+        for path_column in path_columns:
+            for location, idx_frame, wall_time, sharpness in zip(columns[path_column], columns['frame'], columns['wall_time'], columns['sharpness']):
+                if location != '':
+                    frames.append((os.path.join(os.path.dirname(index_path), location), int(idx_frame), float(wall_time), float(sharpness)))
+    return sorted(frames, key=lambda frame: (frame[2], frame[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the extracted frames matching a query on the frame indexes of a folder")
+    parser.add_argument('frames_folder', type=str, help="Folder with the extracted frames (searched recursively)")
+    parser.add_argument('--start', type=str, default=None, help="15:30, 15:30:10 or 2024-09-22 15:30")
+    parser.add_argument('--end', type=str, default=None, help="15:35, 15:35:00 or 2024-09-22 15:35")
+    parser.add_argument('--min-sharpness', type=float, default=None, help="Min variance of the Laplacian (blurred frames are below ~100)")
+    parser.add_argument('--min-brightness', type=float, default=None, help="Min mean gray level 0-255")
+    parser.add_argument('--max-brightness', type=float, default=None, help="Max mean gray level 0-255")
+    parser.add_argument('--output-key', type=str, default=None, help="Only this output, ex: png or jpg_JPEG_QUALITY=95")
+    args = parser.parse_args()
+
+    frames = find_frames(args.frames_folder, args.output_key, start=args.start, end=args.end, min_sharpness=args.min_sharpness,
+                         min_brightness=args.min_brightness, max_brightness=args.max_brightness)
+    for location, idx_frame, wall_time, sharpness in frames:
+        print(f'{datetime.fromtimestamp(wall_time).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]}  frame {idx_frame:6d}  sharpness {sharpness:8.1f}  {location}')
+    print(f'{len(frames)} frames', file=sys.stderr)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# Extraction manifest (extraction_manifest.json in the frames folder): the source video fingerprint, the
+# frame selection and, per output, the last frame written, so interrupted extractions resume where they stopped.
+
+import os, sys
+import time
+import json
+import hashlib
+import threading
+
+from .encoding import get_output_key, get_output_transform
+
+
+class FrameWatermark:
+    # Tracks the last frame index up to which every frame is done, for frames completing in any order
+    def __init__(self, start_frame=0):
+        self.value = start_frame - 1
+        self.done = set()
+        self.lock = threading.Lock()
+
+    def add(self, idx_frame):
+        with self.lock:
+            self.done.add(idx_frame)
+            while self.value + 1 in self.done:
+                self.done.remove(self.value + 1)
+                self.value += 1
+            return self.value
+
+
+def get_manifest_path(frames_path):
+    return os.path.join(frames_path, 'extraction_manifest.json')
+
+
+def load_manifest(frames_path):
+    manifest_path = get_manifest_path(frames_path)
+    if not os.path.isfile(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r') as manifest_file:
+            return json.load(manifest_file)
+    except ValueError:
+        print(f'    Ignoring corrupted manifest: {manifest_path}')
+        return None
+
+
+def save_manifest(frames_path, manifest):
+    # write to a temporary file and rename it, so a kill never leaves a truncated manifest
+    manifest_path = get_manifest_path(frames_path)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def get_source_fingerprint(video_path, sample_size=1024*1024):
+    # size + mtime + sha1 of the first and last MB: detects replaced or re-encoded videos
+    # without reading multi-GB files entirely
+    stat_video = os.stat(video_path)
+    sha1 = hashlib.sha1()
+    with open(video_path, 'rb') as video_file:
+        sha1.update(video_file.read(sample_size))
+        video_file.seek(max(0, stat_video.st_size - sample_size))
+        sha1.update(video_file.read(sample_size))
+    return {'path': os.path.abspath(video_path), 'size': stat_video.st_size, 'mtime': stat_video.st_mtime, 'hash': sha1.hexdigest()}
+
+
+def plan_extraction_resume(frames_path, video_path, frame_outputs, frame_selection, force=False):
+    # Compares the requested outputs with the manifest of a previous run.
+    # Returns the manifest to update, the outputs still missing frames and the frame to restart from.
+    fingerprint = get_source_fingerprint(video_path)
+    manifest = None if force else load_manifest(frames_path)
+    if manifest is not None:
+        source = manifest.get('source', {})
+        if any(source.get(key) != fingerprint[key] for key in ('size', 'mtime', 'hash')):
+            print('    Source video changed since the last extraction, extracting it again')
+            manifest = None
+        elif manifest.get('frame_selection') != frame_selection:
+            print('    Frame selection changed since the last extraction, extracting it again')
+            manifest = None
+    if manifest is None:
+        manifest = {'source': fingerprint, 'frame_selection': frame_selection, 'outputs': {}}
+
+    pending_outputs = []
+    start_frame = -1
+    for frame_output in frame_outputs:
+        output_state = manifest['outputs'].get(get_output_key(frame_output), {'last_frame': -1, 'complete': False})
+        if output_state.get('params', frame_output.params) != frame_output.params \
+           or output_state.get('transform', [None, 'full']) != get_output_transform(frame_output):
+            output_state = {'last_frame': -1, 'complete': False}   # encoder options or crop/size changed, redo this output only
+        if not output_state['complete']:
+            pending_outputs.append(frame_output)
+            start_frame = output_state['last_frame'] + 1 if start_frame < 0 else min(start_frame, output_state['last_frame'] + 1)
+    return manifest, pending_outputs, max(0, start_frame)
+
+
+class ManifestCheckpoint:
+    # Records in the manifest the last frame written for every pending output,
+    # saving it at most once every `period` seconds. `on_save(last_frame)` saves with every
+    # checkpoint the state that must match it (the hashes of the frames kept by the deduplication).
+    def __init__(self, frames_path, manifest, frame_outputs, start_frame=0, period=5.0, frame_writer=None, on_save=None):
+        self.frames_path = frames_path
+        self.frame_writer = frame_writer
+        self.on_save = on_save
+        self.manifest = manifest
+        self.frame_outputs = frame_outputs
+        self.output_keys = [get_output_key(frame_output) for frame_output in frame_outputs]
+        self.watermark = FrameWatermark(start_frame)
+        self.last_frame = start_frame - 1
+        self.period = period
+        self.last_save = time.time()
+        self.lock = threading.Lock()
+        for frame_output in frame_outputs:
+            self.manifest['outputs'][get_output_key(frame_output)] = {'last_frame': start_frame - 1, 'complete': False, 'params': frame_output.params,
+                                                                         'transform': get_output_transform(frame_output)}
+
+    def frame_done(self, idx_frame):
+        self.update(self.watermark.add(idx_frame))
+
+    def update(self, last_frame, force_save=False):
+        with self.lock:
+            self.last_frame = max(self.last_frame, last_frame)
+            if force_save or time.time() - self.last_save >= self.period:
+                self.save()
+
+    def save(self, complete=False):
+        last_frame = self.last_frame
+        if self.frame_writer is not None and not complete:
+            last_frame = self.frame_writer.checkpoint(last_frame)
+        for frame_output in self.frame_outputs:
+            self.manifest['outputs'][get_output_key(frame_output)] = {'last_frame': last_frame, 'complete': complete, 'params': frame_output.params,
+                                                                         'transform': get_output_transform(frame_output)}
+        if self.frame_writer is not None:
+            self.manifest.update(self.frame_writer.get_manifest_state())
+        if self.on_save is not None:
+            self.on_save(last_frame)
+        save_manifest(self.frames_path, self.manifest)
+        self.last_save = time.time()
+
+    def finish(self, last_frame):
+        with self.lock:
+            self.last_frame = max(self.last_frame, last_frame)
+            self.save(complete=True)
@@ -0,0 +1,177 @@
+# Progress lines, per-stage timings and machine-readable metrics of the extraction runs.
+
+import os, sys
+import time
+import json
+import threading
+import collections
+
+
+def clear_terminal_line():
+    sys.stdout.write('\x1b[2K')
+
+
+def print_progress(text):
+    clear_terminal_line()
+    print(f"\r{text}", end='\r')
+
+
+def ignore_progress(text):
+    # default of the library functions, which don't write to the terminal unless asked to
+    pass
+
+
+class ThrottledProgress:
+    # Forwards progress texts to `progress` at most `refresh_hz` times per second and drops the others,
+    # so the terminal (or the queue of a parent process) is not written once per frame
+    def __init__(self, progress=print_progress, refresh_hz=4.0):
+        self.progress = progress
+        self.period = 1.0 / refresh_hz if refresh_hz > 0 else 0.0
+        self.last_call = 0.0
+
+    def __call__(self, text):
+        now = time.perf_counter()
+        if now - self.last_call >= self.period:
+            self.last_call = now
+            self.progress(text)
+
+
+class StageMetrics:
+    # Seconds and call counts accumulated per pipeline stage (grab, retrieve, select, encode <output>,
+    # write, disk write) and queue depth samples, to tell decode-, encode- and I/O-bound runs apart
+    def __init__(self):
+        self.stages = collections.defaultdict(lambda: [0.0, 0])
+        self.queues = collections.defaultdict(lambda: [0, 0, 0])   # sum, max, samples
+
+    def add(self, stage, seconds, count=1):
+        self.stages[stage][0] += seconds
+        self.stages[stage][1] += count
+
+    def sample_queue(self, name, depth):
+        samples = self.queues[name]
+        samples[0] += depth
+        samples[1] = max(samples[1], depth)
+        samples[2] += 1
+
+    def merge(self, metrics_dict):
+        for stage, values in metrics_dict['stages'].items():
+            self.add(stage, values['seconds'], values['count'])
+        for name, values in metrics_dict['queues'].items():
+            samples = self.queues[name]
+            samples[0] += values['mean'] * values['samples']
+            samples[1] = max(samples[1], values['max'])
+            samples[2] += values['samples']
+
+    def as_dict(self):
+        return {'stages': {stage: {'seconds': seconds, 'count': count} for stage, (seconds, count) in self.stages.items()},
+                'queues': {name: {'mean': total / max(1, num_samples), 'max': max_depth, 'samples': num_samples}
+                           for name, (total, max_depth, num_samples) in self.queues.items()}}
+
+    def summary(self):
+        total = max(1e-9, sum(seconds for seconds, count in self.stages.values()))
+        return ' | '.join(f'{stage} {100*seconds/total:.0f}% ({1000*seconds/max(1, count):.1f} ms)'
+                          for stage, (seconds, count) in sorted(self.stages.items(), key=lambda item: -item[1][0]))
+
+
+class MultiLineProgress:
+    # Renders one terminal line per slot, fed by a queue of (slot, text) messages
+    # sent from the worker processes, redrawing at most `refresh_hz` times per second.
+    def __init__(self, message_queue, num_slots, refresh_hz=10):
+        self.message_queue = message_queue
+        self.lines = [''] * num_slots
+        self.refresh_period = 1.0 / refresh_hz
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.drawn = False
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.message_queue.put(None)
+        self.thread.join()
+        self.draw()
+
+    def draw(self):
+        if self.drawn:
+            sys.stdout.write(f'\x1b[{len(self.lines)}A')
+        for line in self.lines:
+            clear_terminal_line()
+            sys.stdout.write(f'{line}\n')
+        sys.stdout.flush()
+        self.drawn = True
+
+    def run(self):
+        last_draw = 0.0
+        while True:
+            message = self.message_queue.get()
+            if message is None:
+                break
+            slot, text = message
+            self.lines[slot] = text
+            if time.time() - last_draw >= self.refresh_period:
+                self.draw()
+                last_draw = time.time()
+
+
+class MetricsWriter:
+    # Machine-readable metrics of an extraction run: a JSON line per video and one for the whole run,
+    # or, for a *.prom file, the Prometheus text format (rewritten after every video)
+    def __init__(self, metrics_path):
+        self.metrics_path = metrics_path
+        self.prometheus = metrics_path.endswith('.prom')
+        self.all_stats = []
+
+    def add_video(self, stats):
+        self.all_stats.append(stats)
+        if self.prometheus:
+            self.write_prometheus()
+        else:
+            with open(self.metrics_path, 'a') as metrics_file:
+                metrics_file.write(json.dumps({'type': 'video', 'time': time.time(), **stats}) + '\n')
+
+    def finish(self, elapsed):
+        if self.prometheus:
+            self.write_prometheus(elapsed)
+            return
+        run_metrics = StageMetrics()
+        for stats in self.all_stats:
+            run_metrics.merge(stats)
+        with open(self.metrics_path, 'a') as metrics_file:
+            metrics_file.write(json.dumps({'type': 'run', 'time': time.time(), 'videos': len(self.all_stats), 'seconds': elapsed,
+                                           'frames': sum(stats['frames'] for stats in self.all_stats),
+                                           'saved': sum(stats['saved'] for stats in self.all_stats),
+                                           'bytes': sum(stats['bytes'] for stats in self.all_stats),
+                                           **run_metrics.as_dict()}) + '\n')
+
+    def write_prometheus(self, elapsed=None):
+        lines = []
+        for stats in self.all_stats:
+            video = os.path.basename(stats['video'])
+            lines.append(f'drone_extract_frames_read_total{{video="{video}"}} {stats["frames"]}')
+            lines.append(f'drone_extract_frames_saved_total{{video="{video}"}} {stats["saved"]}')
+            lines.append(f'drone_extract_bytes_written_total{{video="{video}"}} {stats["bytes"]}')
+            lines.append(f'drone_extract_seconds{{video="{video}"}} {stats["seconds"]:.6f}')
+            for stage, values in stats['stages'].items():
+                lines.append(f'drone_extract_stage_seconds_total{{video="{video}",stage="{stage}"}} {values["seconds"]:.6f}')
+            for name, values in stats['queues'].items():
+                lines.append(f'drone_extract_queue_depth_mean{{video="{video}",queue="{name}"}} {values["mean"]:.3f}')
+                lines.append(f'drone_extract_queue_depth_max{{video="{video}",queue="{name}"}} {values["max"]}')
+        if elapsed is not None:
+            lines.append(f'drone_extract_run_seconds {elapsed:.6f}')
+            lines.append(f'drone_extract_run_frames_per_second {sum(stats["frames"] for stats in self.all_stats) / max(elapsed, 1e-6):.3f}')
+        with open(self.metrics_path + '.tmp', 'w') as metrics_file:
+            metrics_file.write('\n'.join(lines) + '\n')
+        os.replace(self.metrics_path + '.tmp', self.metrics_path)
+
+
+def print_throughput_summary(all_stats, elapsed):
+    total_frames = sum(stats['frames'] for stats in all_stats)
+    total_saved = sum(stats['saved'] for stats in all_stats)
+    total_mb = sum(stats['bytes'] for stats in all_stats) / (1024 * 1024)
+    elapsed = max(elapsed, 1e-6)
+    print(f'Extracted {total_saved} of {total_frames} frames read from {len(all_stats)} videos in {elapsed:.1f}s: '
+          f'{total_frames/elapsed:.1f} frames/s read, {total_saved/elapsed:.1f} frames/s saved, '
+          f'{total_mb:.1f} MB written ({total_mb/elapsed:.1f} MB/s)')
+    for stats in all_stats:
+        if 'error' in stats:
+            print(f"    Skipped {stats['video']}: {stats['error']}")
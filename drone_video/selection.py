@@ -0,0 +1,204 @@
+# Which frames of a video are extracted: stride, target fps, time window, scene changes, near-duplicate
+# hashes and the selection files written in manual mode.
+
+import os, sys
+import cv2
+import json
+import bisect
+import fcntl
+import numpy as np
+
+
+def get_frame_selection(stride=1, target_fps=0.0, start_time=0.0, end_time=-1.0, scene_threshold=0.0, scene_metric='diff', frame_ranges=None,
+                        dedup_hash='', dedup_distance=6, dedup_window=4096):
+    # Parameters of FrameSelector, also stored in the manifest: changing them invalidates previous extractions
+    frame_selection = {'stride': stride, 'target_fps': target_fps, 'start_time': start_time, 'end_time': end_time,
+                       'scene_threshold': scene_threshold, 'scene_metric': scene_metric}
+    if frame_ranges is not None:
+        frame_selection['frame_ranges'] = frame_ranges
+    if dedup_hash:
+        frame_selection['dedup'] = {'hash': dedup_hash, 'distance': dedup_distance, 'window': dedup_window}
+    return frame_selection
+
+
+def compute_frame_hash(frame, hash_type='dhash'):
+    # 64-bit perceptual hash of the frame. dhash: signs of the horizontal gradients of a 9x8 thumbnail,
+    # phash: signs of the 8x8 lowest frequencies of the DCT of a 32x32 thumbnail compared with their median
+    if hash_type == 'phash':
+        small = cv2.cvtColor(cv2.resize(frame, (32, 32), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        frequencies = cv2.dct(np.float32(small))[:8, :8]
+        bits = frequencies > np.median(frequencies)
+    else:
+        small = cv2.cvtColor(cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        bits = small[:, 1:] > small[:, :-1]
+    return np.packbits(bits.ravel()).view(np.uint64)[0]
+
+
+class DedupIndex:
+    # Hashes of the frames kept, to skip near duplicates: a frame is dropped when the Hamming distance of its
+    # hash to one of the last `window` kept hashes is <= `distance` bits. The index is shared by the videos of
+    # a folder and by reruns through a .npz file (locked while it is read and updated). The hashes of a video
+    # replace the ones of its previous runs, so extracting a video again doesn't compare it with itself
+    # (unless `resume`, where the frames already extracted, before `start_frame`, stay in the index).
+    def __init__(self, index_path, video_name, hash='dhash', distance=6, window=4096, resume=False, start_frame=None):
+        self.index_path = index_path
+        self.video_name = video_name
+        self.hash_type = hash
+        self.distance = distance
+        self.window = max(1, window)
+        self.hashes = np.zeros(self.window, dtype=np.uint64)   # ring buffer of the recent kept hashes
+        self.num_hashes = 0
+        self.new_hashes = []
+        self.new_frames = []
+        self.num_duplicates = 0
+        with self.lock_index():
+            hashes, videos, frames = self.load()
+        keep = videos != video_name
+        if resume:
+            keep |= frames < start_frame if start_frame is not None else True
+        hashes, videos, frames = hashes[keep], videos[keep], frames[keep]
+        for frame_hash in hashes[-self.window:]:
+            self.add(frame_hash)
+        self.new_hashes = list(hashes[videos == video_name])
+        self.new_frames = list(frames[videos == video_name])
+
+    def lock_index(self):
+        lock_file = open(self.index_path + '.lock', 'w')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file   # closing the file releases the lock
+
+    def load(self):
+        # (hashes, videos, frames), the frames are -1 in the indexes saved without them
+        if not os.path.isfile(self.index_path):
+            return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=str), np.zeros(0, dtype=np.int64)
+        with np.load(self.index_path) as index:
+            if str(index['hash_type']) != self.hash_type:
+                print(f"    {self.index_path} has {index['hash_type']} hashes, not {self.hash_type}, starting a new index")
+                return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=str), np.zeros(0, dtype=np.int64)
+            frames = index['frames'] if 'frames' in index.files else np.full(len(index['hashes']), -1, dtype=np.int64)
+            return index['hashes'], index['videos'], frames
+
+    def add(self, frame_hash, idx_frame=-1):
+        self.hashes[self.num_hashes % self.window] = frame_hash
+        self.num_hashes += 1
+        self.new_hashes.append(frame_hash)
+        self.new_frames.append(idx_frame)
+
+    def is_novel(self, frame, idx_frame=-1):
+        frame_hash = compute_frame_hash(frame, self.hash_type)
+        num_recent = min(self.num_hashes, self.window)
+        if num_recent > 0 and np.bitwise_count(self.hashes[:num_recent] ^ frame_hash).min() <= self.distance:
+            self.num_duplicates += 1
+            return False
+        self.add(frame_hash, idx_frame)
+        return True
+
+    def save(self, last_frame=None):
+        # Merges with the hashes saved meanwhile by other videos. With `last_frame` (manifest checkpoints),
+        # only the hashes of the frames up to it are saved: a resumed run decodes the next ones again.
+        with self.lock_index():
+            hashes, videos, frames = self.load()
+            keep = videos != self.video_name
+            new_frames = np.array(self.new_frames, dtype=np.int64)
+            new_hashes = np.array(self.new_hashes, dtype=np.uint64)
+            if last_frame is not None:
+                new_hashes, new_frames = new_hashes[new_frames <= last_frame], new_frames[new_frames <= last_frame]
+            hashes = np.concatenate([hashes[keep], new_hashes])[-self.window:]
+            videos = np.concatenate([videos[keep], np.full(len(new_hashes), self.video_name)])[-self.window:]
+            frames = np.concatenate([frames[keep], new_frames])[-self.window:]
+            with open(self.index_path + '.tmp', 'wb') as index_file:
+                np.savez(index_file, hashes=hashes, videos=videos, frames=frames, hash_type=self.hash_type)
+            os.replace(self.index_path + '.tmp', self.index_path)
+
+
+def get_selection_path(video_path):
+    return os.path.splitext(video_path)[0] + '.selection.json'
+
+
+def load_selection(video_path):
+    # Frames and ranges picked in manual mode (m and r keys), None if there is no selection file
+    try:
+        with open(get_selection_path(video_path), 'r') as selection_file:
+            return json.load(selection_file)
+    except FileNotFoundError:
+        return None
+
+
+def save_selection(video_path, selection):
+    selection_path = get_selection_path(video_path)
+    with open(selection_path + '.tmp', 'w') as selection_file:
+        json.dump(selection, selection_file, indent=2)
+    os.replace(selection_path + '.tmp', selection_path)
+
+
+def get_selection_ranges(selection):
+    # Sorted and merged [first, last] frame ranges (inclusive) of the selected frames and ranges
+    frame_ranges = sorted([[idx_frame, idx_frame] for idx_frame in selection.get('frames', [])] + [list(frame_range) for frame_range in selection.get('ranges', [])])
+    merged_ranges = []
+    for first_frame, last_frame in frame_ranges:
+        if len(merged_ranges) > 0 and first_frame <= merged_ranges[-1][1] + 1:
+            merged_ranges[-1][1] = max(merged_ranges[-1][1], last_frame)
+        else:
+            merged_ranges.append([first_frame, last_frame])
+    return merged_ranges
+
+
+class FrameSelector:
+    # Decides which frames are saved: every `stride`-th frame, `target_fps` frames per second, only frames
+    # in [start_time, end_time) seconds and, with `scene_threshold` > 0, only frames that differ enough from
+    # the last saved one. `frame_ranges` ([first, last] inclusive, sorted) limits the frames to a selection file.
+    # Frame-index rules are checked before decoding, the content rule after.
+    def __init__(self, fps, stride=1, target_fps=0.0, start_time=0.0, end_time=-1.0, scene_threshold=0.0, scene_metric='diff', frame_ranges=None,
+                 dedup=None, dedup_index=None):
+        self.fps = fps if fps > 0 else 30.0
+        self.stride = max(1, stride)
+        self.target_fps = target_fps
+        self.start_frame = int(round(start_time * self.fps))
+        self.end_frame = int(round(end_time * self.fps)) if end_time >= 0 else -1
+        self.scene_threshold = scene_threshold
+        self.scene_metric = scene_metric
+        self.last_kept = None
+        self.dedup_index = dedup_index
+        self.frame_ranges = frame_ranges
+        if frame_ranges is not None:
+            # decoding stops after the last selected frame
+            self.range_starts = [first_frame for first_frame, last_frame in frame_ranges]
+            last_selected = frame_ranges[-1][1] + 1 if len(frame_ranges) > 0 else 0
+            self.end_frame = last_selected if self.end_frame < 0 else min(self.end_frame, last_selected)
+
+    def is_candidate(self, idx_frame):
+        if idx_frame < self.start_frame or (self.end_frame >= 0 and idx_frame >= self.end_frame):
+            return False
+        if self.frame_ranges is not None:
+            idx_range = bisect.bisect_right(self.range_starts, idx_frame) - 1
+            if idx_range < 0 or idx_frame > self.frame_ranges[idx_range][1]:
+                return False
+        idx_frame -= self.start_frame
+        if idx_frame % self.stride != 0:
+            return False
+        if self.target_fps > 0 and self.target_fps < self.fps and idx_frame > 0:
+            # keep the first frame of every 1/target_fps interval
+            return int(idx_frame * self.target_fps / self.fps) != int((idx_frame - 1) * self.target_fps / self.fps)
+        return True
+
+    def checks_content(self):
+        return self.scene_threshold > 0 or self.dedup_index is not None
+
+    def keep(self, frame, idx_frame=-1):
+        small = None
+        if self.scene_threshold > 0:
+            small = cv2.cvtColor(cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+            if self.scene_metric == 'hist':
+                small = cv2.calcHist([small], [0], None, [32], [0, 256])
+                cv2.normalize(small, small)
+            if self.last_kept is not None:
+                if self.scene_metric == 'hist':
+                    score = cv2.compareHist(self.last_kept, small, cv2.HISTCMP_BHATTACHARYYA)
+                else:
+                    score = cv2.norm(self.last_kept, small, cv2.NORM_L1) / (small.size * 255.0)
+                if score < self.scene_threshold:
+                    return False
+        if self.dedup_index is not None and not self.dedup_index.is_novel(frame, idx_frame):
+            return False
+        self.last_kept = small
+        return True
@@ -0,0 +1,320 @@
+# Frame sinks: where the encoded outputs of the frames of a video are stored. One file per frame and
+# output (FileFrameWriter), WebDataset-style tar shards (ShardFrameWriter), one data file with an offset
+# index per video (ArchiveFrameWriter) or a dict in memory (MemoryFrameWriter).
+
+import os, sys
+import io
+import re
+import time
+import queue
+import tarfile
+import threading
+import numpy as np
+
+from .encoding import get_frame_paths, get_output_key
+
+
+DEFAULT_MAX_PENDING_BYTES = 512 * 1024 * 1024   # without --max-memory: 256 4K PNGs would be several GB
+
+
+class BatchedFileWriter:
+    # Writes (path, bytes) pairs from a background thread that takes them from a bounded queue in batches,
+    # so the decoding thread only waits on the filesystem when `max_pending` files or `max_pending_bytes`
+    # (0: no limit) are already queued
+    def __init__(self, max_pending=256, batch_size=32, max_pending_bytes=DEFAULT_MAX_PENDING_BYTES):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.batch_size = batch_size
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes = 0
+        self.bytes_written = threading.Condition()
+        self.error = None
+        self.seconds = 0.0
+        self.count = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            start = time.perf_counter()
+            for item in batch:
+                if item is not None and self.error is None:
+                    try:
+                        with open(item[0], 'wb') as frame_file:
+                            frame_file.write(item[1])
+                        self.count += 1
+                    except Exception as error:
+                        self.error = error
+                if item is not None:
+                    with self.bytes_written:
+                        self.pending_bytes -= len(item[1])
+                        self.bytes_written.notify_all()
+                self.queue.task_done()
+            self.seconds += time.perf_counter() - start
+            if None in batch:
+                return
+
+    def put(self, path, data):
+        if self.error is not None:
+            raise self.error
+        with self.bytes_written:
+            if self.max_pending_bytes > 0:
+                # a file larger than the limit is queued alone
+                self.bytes_written.wait_for(lambda: self.pending_bytes == 0 or self.pending_bytes + len(data) <= self.max_pending_bytes)
+            self.pending_bytes += len(data)
+        self.queue.put((path, data))
+
+    def flush(self):
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class FrameSink:
+    # Interface of the frame writers. write() stores the encoded outputs of a frame (in frame order) and returns
+    # the bytes written, checkpoint(last_frame) returns the last frame safely stored, so the manifest never
+    # points past it, and close() flushes everything. `supports_segments`: several processes can write
+    # the frames of the same video. `last_locations`: where write() stored each output, relative to the
+    # frames folder (recorded in the frame index). get_manifest_state() returns what the writer needs
+    # to find its files again when resuming, saved in the manifest with every checkpoint.
+    supports_segments = False
+    last_location = ''
+    last_locations = []
+
+    def write(self, idx_frame, frame_outputs, encoded_frames):
+        raise NotImplementedError
+
+    def checkpoint(self, last_frame):
+        return last_frame
+
+    def get_manifest_state(self):
+        return {}
+
+    def pending_writes(self):
+        return 0
+
+    def close(self, metrics=None):
+        pass
+
+
+class FileFrameWriter(FrameSink):
+    # Default layout: one file per frame and output in the frames folder
+    supports_segments = True
+
+    def __init__(self, frames_path, video_name, max_pending_bytes=DEFAULT_MAX_PENDING_BYTES):
+        self.frames_path = frames_path
+        self.video_name = video_name
+        self.file_writer = BatchedFileWriter(max_pending_bytes=max_pending_bytes)
+        self.last_location = frames_path
+
+    def write(self, idx_frame, frame_outputs, encoded_frames):
+        bytes_written = 0
+        self.last_locations = []
+        for (frame_path, frame_qual), encoded in zip(get_frame_paths(self.frames_path, self.video_name, idx_frame, frame_outputs), encoded_frames):
+            self.file_writer.put(frame_path, encoded)
+            bytes_written += len(encoded)
+            self.last_location = frame_path
+            self.last_locations.append(os.path.basename(frame_path))
+        return bytes_written
+
+    def checkpoint(self, last_frame):
+        # returns the last frame that is safely stored
+        self.file_writer.flush()
+        return last_frame
+
+    def pending_writes(self):
+        return self.file_writer.queue.qsize()
+
+    def close(self, metrics=None):
+        self.file_writer.close()
+        if metrics is not None:
+            metrics.add('disk write', self.file_writer.seconds, self.file_writer.count)
+
+
+class ShardFrameWriter(FrameSink):
+    # WebDataset-style tar shards of at most `max_shard_bytes`: {video}_{shard:05d}.tar holding
+    # {video}_frame_{idx:06d}.png and {video}_frame_{idx:06d}.q{quality}.jpg members.
+    # A shard is written as .tar.part and renamed when closed, so every .tar is complete.
+    # `shards`: the [name, last frame] of the closed shards recorded in the manifest by the last checkpoint.
+    # The ones with only frames before `start_frame` are kept, every other shard of the video (closed after
+    # the checkpoint, or left by a previous extraction) is deleted, as its frames are written again.
+    supports_segments = False
+
+    def __init__(self, frames_path, video_name, max_shard_bytes=1024*1024*1024, start_frame=0, shards=()):
+        self.frames_path = frames_path
+        self.video_name = video_name
+        self.max_shard_bytes = max_shard_bytes
+        self.shards = []
+        for name, last_frame in shards:
+            if last_frame >= start_frame or not os.path.isfile(os.path.join(frames_path, name)):
+                break
+            self.shards.append([name, last_frame])
+        kept_names = {name for name, last_frame in self.shards}
+        shard_pattern = re.compile(re.escape(video_name) + r'_\d{5}\.tar(\.part)?')
+        for filename in os.listdir(frames_path):
+            if shard_pattern.fullmatch(filename) and filename not in kept_names:
+                os.remove(os.path.join(frames_path, filename))
+        self.idx_shard = len(self.shards)
+        self.tar = None
+        self.shard_bytes = 0
+        self.last_frame_in_shard = start_frame - 1
+        self.last_frame_in_closed_shards = start_frame - 1
+        self.last_location = frames_path
+
+    def get_shard_path(self):
+        return os.path.join(self.frames_path, f'{self.video_name}_{self.idx_shard:05d}.tar')
+
+    def close_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+            os.replace(self.get_shard_path() + '.part', self.get_shard_path())
+            self.shards.append([os.path.basename(self.get_shard_path()), self.last_frame_in_shard])
+            self.last_frame_in_closed_shards = self.last_frame_in_shard
+            self.idx_shard += 1
+            self.tar = None
+            self.shard_bytes = 0
+
+    def write(self, idx_frame, frame_outputs, encoded_frames):
+        if self.tar is not None and self.shard_bytes >= self.max_shard_bytes:
+            self.close_shard()
+        if self.tar is None:
+            self.tar = tarfile.open(self.get_shard_path() + '.part', 'w')
+        key = f'{self.video_name}_frame_{idx_frame:06d}'
+        bytes_written = 0
+        self.last_locations = []
+        for frame_output, encoded in zip(frame_outputs, encoded_frames):
+            member_name = f'{key}{frame_output.resize_suffix}.{frame_output.ext}' if frame_output.quality is None else f'{key}{frame_output.resize_suffix}.q{frame_output.quality}.{frame_output.ext}'
+            member = tarfile.TarInfo(member_name)
+            member.size = len(encoded)
+            member.mtime = time.time()
+            self.tar.addfile(member, io.BytesIO(encoded))
+            bytes_written += len(encoded)
+            self.last_locations.append(f'{os.path.basename(self.get_shard_path())}:{member_name}')
+        self.shard_bytes += bytes_written
+        self.last_frame_in_shard = idx_frame
+        self.last_location = f'{self.get_shard_path()}:{key}'
+        return bytes_written
+
+    def checkpoint(self, last_frame):
+        return min(last_frame, self.last_frame_in_closed_shards)
+
+    def get_manifest_state(self):
+        return {'shards': [list(shard) for shard in self.shards]}
+
+    def close(self, metrics=None):
+        self.close_shard()
+
+
+class ArchiveFrameWriter(FrameSink):
+    # All the encoded outputs of a video appended to {video}.frames.bin, with an offset index in
+    # {video}.frames.index.npz (one (frame, output, offset, length) record per encoded image), so
+    # a reader fetches a frame with one seek or a slice of a memory-mapped file. See read_archive_frame().
+    supports_segments = False
+    index_dtype = [('frame', '<i8'), ('output', '<i4'), ('offset', '<i8'), ('length', '<i8')]
+
+    def __init__(self, frames_path, video_name, frame_outputs, start_frame=0):
+        self.data_path, self.index_path = get_archive_paths(frames_path, video_name)
+        self.output_keys = []
+        self.records = []
+        if os.path.isfile(self.data_path) and os.path.isfile(self.index_path):
+            # resuming: drop the records the new run will write again
+            output_keys, records = load_archive_index(self.index_path)
+            self.output_keys = list(output_keys)
+            pending_keys = [get_output_key(frame_output) for frame_output in frame_outputs]
+            self.records = [tuple(record) for record in records.tolist()
+                            if record[0] < start_frame or self.output_keys[record[1]] not in pending_keys]
+        for frame_output in frame_outputs:
+            if get_output_key(frame_output) not in self.output_keys:
+                self.output_keys.append(get_output_key(frame_output))
+
+        data_size = max([offset + length for frame, output, offset, length in self.records], default=0)
+        self.data_file = open(self.data_path, 'r+b' if os.path.isfile(self.data_path) else 'wb')
+        self.data_file.truncate(data_size)   # bytes after the last indexed record belong to an interrupted run
+        self.data_file.seek(data_size)
+        self.last_location = self.data_path
+
+    def write(self, idx_frame, frame_outputs, encoded_frames):
+        bytes_written = 0
+        self.last_locations = []
+        for frame_output, encoded in zip(frame_outputs, encoded_frames):
+            self.last_locations.append(f'{os.path.basename(self.data_path)}:{self.data_file.tell()}')
+            self.records.append((idx_frame, self.output_keys.index(get_output_key(frame_output)), self.data_file.tell(), len(encoded)))
+            self.data_file.write(encoded)
+            bytes_written += len(encoded)
+        return bytes_written
+
+    def save_index(self):
+        # the data must reach the disk before the index that points to it
+        self.data_file.flush()
+        os.fsync(self.data_file.fileno())
+        with open(self.index_path + '.tmp', 'wb') as index_file:
+            np.savez(index_file, outputs=np.array(self.output_keys), records=np.array(self.records, dtype=self.index_dtype))
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def checkpoint(self, last_frame):
+        self.save_index()
+        return last_frame
+
+    def close(self, metrics=None):
+        self.save_index()
+        self.data_file.close()
+
+
+class MemoryFrameWriter(FrameSink):
+    # Keeps the encoded outputs in `frames` ({frame index: {output key: bytes}}), for pipelines that
+    # consume the encoded frames directly instead of reading them back from disk
+    def __init__(self):
+        self.frames = {}
+        self.last_location = 'memory'
+
+    def write(self, idx_frame, frame_outputs, encoded_frames):
+        self.frames[idx_frame] = {get_output_key(frame_output): encoded for frame_output, encoded in zip(frame_outputs, encoded_frames)}
+        self.last_locations = [f'memory:{idx_frame}'] * len(encoded_frames)
+        return sum(len(encoded) for encoded in encoded_frames)
+
+
+def get_archive_paths(frames_path, video_name):
+    return os.path.join(frames_path, f'{video_name}.frames.bin'), os.path.join(frames_path, f'{video_name}.frames.index.npz')
+
+
+def load_archive_index(index_path):
+    with np.load(index_path) as index:
+        return index['outputs'].tolist(), index['records']
+
+
+def read_archive_frame(frames_path, video_name, idx_frame, output_key='png', index=None):
+    # Returns the encoded bytes of one frame output stored by ArchiveFrameWriter, or None.
+    # Pass `index=load_archive_index(...)` when reading many frames to load the index only once.
+    data_path, index_path = get_archive_paths(frames_path, video_name)
+    output_keys, records = index if index is not None else load_archive_index(index_path)
+    if output_key not in output_keys:
+        return None
+    matches = records[(records['frame'] == idx_frame) & (records['output'] == output_keys.index(output_key))]
+    if len(matches) == 0:
+        return None
+    with open(data_path, 'rb') as data_file:
+        data_file.seek(int(matches[-1]['offset']))
+        return data_file.read(int(matches[-1]['length']))
+
+
+def create_frame_writer(output_backend, frames_path, video_name, frame_outputs, start_frame=0, shard_size_mb=1024, max_pending_bytes=DEFAULT_MAX_PENDING_BYTES, manifest=None):
+    # only the files backend queues the encoded frames, the others write them in the calling thread
+    if output_backend == 'files':
+        return FileFrameWriter(frames_path, video_name, max_pending_bytes)
+    if output_backend == 'shards':
+        return ShardFrameWriter(frames_path, video_name, int(shard_size_mb * 1024 * 1024), start_frame,
+                                manifest.get('shards', []) if manifest is not None else [])
+    if output_backend == 'archive':
+        return ArchiveFrameWriter(frames_path, video_name, frame_outputs, start_frame)
+    raise Exception(f'Unknown output backend: {output_backend}')
@@ -0,0 +1,159 @@
+# Streaming access to the frames of a video: FrameSource yields (index, timestamp, frame) lazily,
+# decoding only the selected frames, into reused buffers when asked to.
+
+import os, sys
+import cv2
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from .video_metadata import get_video_metadata
+from .selection import FrameSelector, get_frame_selection
+
+
+def read_next_frame(cap, idx_frame, frame_selector=None, metrics=None, buffer=None):
+    # Returns (False, None) at the end of the video and (True, None) for frames that are not selected.
+    # Frames rejected by index are only grabbed, which skips the retrieve (conversion to BGR and copy).
+    # The frame is decoded into `buffer` when it has the right shape, otherwise in a new array.
+    start = time.perf_counter()
+    if not cap.grab():
+        return False, None
+    grabbed = time.perf_counter()
+    if metrics is not None:
+        metrics.add('grab', grabbed - start)
+    if frame_selector is not None and not frame_selector.is_candidate(idx_frame):
+        return True, None
+    ret, frame = cap.retrieve(buffer)
+    if not ret:
+        return False, None
+    retrieved = time.perf_counter()
+    if metrics is not None:
+        metrics.add('retrieve', retrieved - grabbed)
+    if frame_selector is not None and frame_selector.checks_content():
+        keep = frame_selector.keep(frame, idx_frame)
+        if metrics is not None:
+            metrics.add('select', time.perf_counter() - retrieved)
+        if not keep:
+            return True, None
+    return True, frame
+
+
+class FrameSource:
+    # Iterates lazily over the frames of a video as (index, timestamp, frame), the timestamp being the
+    # presentation time in seconds. Frames outside the selection are only grabbed, not converted to BGR.
+    # The keyword arguments are the ones of get_frame_selection(), or pass a FrameSelector:
+    #     for idx_frame, timestamp, frame in FrameSource('FIMI0001.MP4', stride=10, start_time=30.0):
+    # With reuse_buffer=True every frame is decoded into the array of the previous one, which is only
+    # valid until the next iteration. An opened `cap` is used as is and left open by close().
+    def __init__(self, video_path, start_frame=0, end_frame=-1, frame_selector=None, cap=None, metrics=None, reuse_buffer=False, **frame_selection):
+        self.video_path = video_path
+        self.cap = cap if cap is not None else cv2.VideoCapture(video_path)
+        self.owns_cap = cap is None
+        self.metadata = get_video_metadata(video_path, self.cap)
+        if frame_selector is None:
+            frame_selector = FrameSelector(self.metadata.fps, **get_frame_selection(**frame_selection))
+        self.frame_selector = frame_selector
+        self.metrics = metrics
+        self.reuse_buffer = reuse_buffer
+        self.buffer = None
+        self.end_frame = end_frame
+        if frame_selector.end_frame >= 0:
+            self.end_frame = frame_selector.end_frame if end_frame < 0 else min(end_frame, frame_selector.end_frame)
+        self.next_frame = 0   # index of the frame returned by the next read()
+        self.first_frame = max(start_frame, frame_selector.start_frame)
+        self.seek(self.first_frame)
+
+    def seek(self, idx_frame):
+        # the backend restarts decoding at the keyframe before `idx_frame`
+        if idx_frame != self.next_frame:
+            start = time.perf_counter()
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, idx_frame)
+            if self.metrics is not None:
+                self.metrics.add('seek', time.perf_counter() - start)
+            self.next_frame = idx_frame
+
+    def read(self, buffer=None):
+        # Returns (index, timestamp, frame) with frame=None if the frame is not selected, or None at the end
+        # of the video or of the range. The frame is decoded into `buffer` if it has the right shape.
+        if not self.cap.isOpened() or (self.end_frame >= 0 and self.next_frame >= self.end_frame):
+            return None
+        ret, frame = read_next_frame(self.cap, self.next_frame, self.frame_selector, self.metrics, buffer)
+        if not ret:
+            return None
+        idx_frame = self.next_frame
+        self.next_frame += 1
+        return idx_frame, self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0, frame
+
+    def __iter__(self):
+        while True:
+            item = self.read(self.buffer if self.reuse_buffer else None)
+            if item is None:
+                return
+            if item[2] is not None:
+                self.buffer = item[2]
+                yield item
+
+    def close(self):
+        if self.owns_cap:
+            self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FrameBufferPool:
+    # Preallocated frame arrays that cap.retrieve() decodes into, so the extraction doesn't allocate a new
+    # frame per iteration and its memory stays fixed. With shared=True the arrays live in shared memory
+    # blocks, passed to the worker processes by name instead of pickling the frames.
+    # The arrays are allocated with the shape of the first frame stored.
+    def __init__(self, num_buffers, shared=False):
+        self.num_buffers = max(1, num_buffers)
+        self.shared = shared
+        self.buffers = []
+        self.blocks = []
+        self.free = []
+
+    def allocate(self, shape, dtype):
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        for idx_buffer in range(self.num_buffers):
+            if self.shared:
+                self.blocks.append(shared_memory.SharedMemory(create=True, size=nbytes))
+                self.buffers.append(np.ndarray(shape, dtype, buffer=self.blocks[-1].buf))
+            else:
+                self.buffers.append(np.empty(shape, dtype))
+        self.free = list(range(self.num_buffers))
+
+    def acquire(self):
+        # index of a free buffer, None before the first frame or if they are all in use
+        return self.free.pop() if len(self.free) > 0 else None
+
+    def get(self, idx_buffer):
+        return self.buffers[idx_buffer] if idx_buffer is not None else None
+
+    def release(self, idx_buffer):
+        if idx_buffer is not None:
+            self.free.append(idx_buffer)
+
+    def store(self, frame):
+        # copies a frame not decoded into a buffer (the first one), returns its buffer index or None
+        if len(self.buffers) == 0:
+            self.allocate(frame.shape, frame.dtype)
+        if frame.shape != self.buffers[0].shape or frame.dtype != self.buffers[0].dtype:
+            return None
+        idx_buffer = self.acquire()
+        if idx_buffer is not None:
+            np.copyto(self.buffers[idx_buffer], frame)
+        return idx_buffer
+
+    def get_block_name(self, idx_buffer):
+        return self.blocks[idx_buffer].name
+
+    def close(self):
+        self.buffers = []   # the views must be released before closing the blocks
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
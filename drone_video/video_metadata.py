@@ -0,0 +1,168 @@
+# Video properties (frame count, size, fps, codec, duration, keyframes) read from the container metadata,
+# without decoding, and cached in a JSON index keyed by path + size + mtime.
+# The index is saved in ~/.cache/drone_video/video_metadata.json, set DRONE_VIDEO_METADATA_CACHE
+# to use another file or to an empty string to disable it.
+
+import os, sys
+import cv2
+import json
+import threading
+from collections import namedtuple
+
+
+VideoMetadata = namedtuple('VideoMetadata', ['frame_count', 'width', 'height', 'fps', 'codec', 'duration'])
+
+index_lock = threading.Lock()
+loaded_indexes = {}
+
+
+def get_default_index_path():
+    return os.environ.get('DRONE_VIDEO_METADATA_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'drone_video', 'video_metadata.json'))
+
+
+def get_fourcc_string(fourcc):
+    return ''.join(chr((int(fourcc) >> 8 * idx) & 0xFF) for idx in range(4)).strip('\0 ')
+
+
+def count_frames_by_grabbing(video_path):
+    # Last resort for containers that don't store the number of frames: grab() demuxes and decodes
+    # every frame but skips the conversion to BGR, and the result is cached in the index.
+    cap = cv2.VideoCapture(video_path)
+    frame_count = 0
+    try:
+        while cap.grab():
+            frame_count += 1
+    finally:
+        cap.release()
+    return frame_count
+
+
+def read_video_metadata(cap, video_path=''):
+    if not cap.isOpened():
+        raise Exception(f"Error: Unable to open video file: {video_path}")
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if frame_count <= 0 and video_path:
+        frame_count = count_frames_by_grabbing(video_path)
+    return VideoMetadata(frame_count=frame_count,
+                         width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                         height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                         fps=fps,
+                         codec=get_fourcc_string(cap.get(cv2.CAP_PROP_FOURCC)),
+                         duration=frame_count / fps if fps > 0 else 0.0)
+
+
+def load_index(index_path):
+    if index_path not in loaded_indexes:
+        try:
+            with open(index_path, 'r') as index_file:
+                loaded_indexes[index_path] = json.load(index_file)
+        except (OSError, ValueError):
+            loaded_indexes[index_path] = {}
+    return loaded_indexes[index_path]
+
+
+def save_index(index_path, new_entries):
+    # Merges with the entries saved meanwhile by other processes before replacing the file
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    try:
+        with open(index_path, 'r') as index_file:
+            index = json.load(index_file)
+    except (OSError, ValueError):
+        index = {}
+    for key in new_entries:   # drops the entries of older versions of the same files
+        video_path = key.rsplit('|', 2)[0]
+        for old_key in [old_key for old_key in index if old_key.rsplit('|', 2)[0] == video_path]:
+            del index[old_key]
+    index.update(new_entries)
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as index_file:
+        json.dump(index, index_file)
+    os.replace(tmp_path, index_path)
+    loaded_indexes[index_path] = index
+
+
+def get_index_key(video_path):
+    stat = os.stat(video_path)
+    return f'{video_path}|{stat.st_size}|{stat.st_mtime_ns}'
+
+
+def get_video_metadata(video_path, cap=None, index_path=None):
+    # Uses the already opened `cap` if given (it is not released nor moved), otherwise opens the video only on a cache miss
+    if index_path is None:
+        index_path = get_default_index_path()
+    video_path = os.path.abspath(video_path)
+    key = get_index_key(video_path)
+
+    if index_path:
+        with index_lock:
+            entry = load_index(index_path).get(key)
+        if entry is not None:
+            return VideoMetadata(**{field: entry[field] for field in VideoMetadata._fields})
+
+    if cap is None:
+        cap = cv2.VideoCapture(video_path)
+        try:
+            metadata = read_video_metadata(cap, video_path)
+        finally:
+            cap.release()
+    else:
+        metadata = read_video_metadata(cap, video_path)
+
+    if index_path:
+        with index_lock:
+            try:
+                save_index(index_path, {key: metadata._asdict()})
+            except OSError as error:
+                print(f'    Unable to save the video metadata index {index_path}: {error}', file=sys.stderr)
+    return metadata
+
+
+def find_keyframe_indices(video_path):
+    # Reads the compressed packets without decoding them (raw mode of the FFmpeg backend) and returns
+    # the indices of the keyframes, or None if the backend can't do it
+    try:
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    except cv2.error:
+        return None
+    try:
+        if not cap.isOpened() or cap.get(cv2.CAP_PROP_FORMAT) != -1:
+            return None
+        keyframes = []
+        idx_packet = 0
+        while cap.grab():
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(idx_packet)
+            idx_packet += 1
+        return keyframes
+    finally:
+        cap.release()
+
+
+def get_keyframe_indices(video_path, index_path=None):
+    # Keyframe indices cached in the same index entry as the metadata of the video
+    if index_path is None:
+        index_path = get_default_index_path()
+    video_path = os.path.abspath(video_path)
+    if not index_path:
+        return find_keyframe_indices(video_path)
+    metadata = get_video_metadata(video_path, index_path=index_path)
+    key = get_index_key(video_path)
+    with index_lock:
+        entry = load_index(index_path).get(key, {})
+    if 'keyframes' in entry:
+        return entry['keyframes']
+    keyframes = find_keyframe_indices(video_path)
+    if keyframes is not None:
+        with index_lock:
+            try:
+                save_index(index_path, {key: {**metadata._asdict(), 'keyframes': keyframes}})
+            except OSError as error:
+                print(f'    Unable to save the video metadata index {index_path}: {error}', file=sys.stderr)
+    return keyframes
+
+
+def count_num_frames_video(video_path, verbose=False, cap=None):
+    metadata = get_video_metadata(video_path, cap)
+    if verbose: print(f'    Counting num frames video: {metadata.frame_count} - {metadata.width}x{metadata.height} - fps: {metadata.fps} - codec: {metadata.codec}')
+    return metadata.frame_count, metadata.width, metadata.height, metadata.fps
@@ -6,7 +6,8 @@ import cv2
 import argparse
 import time
 from datetime import datetime
-import threading
+
+from drone_video import count_num_frames_video, PreviewFrames, start_monitoring_cv2_window
 
 
 def parse_args():
@@ -15,6 +16,10 @@ def parse_args():
 
     parser = argparse.ArgumentParser(description="Just play a video in screen")
     parser.add_argument('filepath', type=str, help="")
+    parser.add_argument('--cache-mb', type=int, default=512, help="Memory for the decoded frames kept to step back and forward instantly")
+    parser.add_argument('--read-ahead', type=int, default=16, help="Frames decoded ahead of the playback in background")
+    parser.add_argument('--preview', type=str, default='off', choices=['off', 'lrv', 'scale', 'auto'], help="Show the LRV proxy (lrv), frames scaled to --preview-width (scale) or the LRV if it exists (auto)")
+    parser.add_argument('--preview-width', type=int, default=1280, help="Width of the scaled preview frames")
     # parser.add_argument('--frame-folder', type=str, required=True, help="Folder to save extracted frames")
     
     # parser.add_argument('--valid-ext', type=list_of_strings, default='MP4', help="MP4,AVI")
@@ -28,57 +33,11 @@ def parse_args():
     return args
 
 
-def count_num_frames_video(video_path, verbose=False):
-    cap = cv2.VideoCapture(video_path)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    try:
-        if verbose: print(f'    Counting num frames video: ', end='')
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        if verbose: print(f'{frame_count} - {width}x{height} - fps: {fps}')
-    except:
-        frame_count = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            frame_count += 1
-            if verbose:
-                print(f'    Counting num frames video: {frame_count}', end='\r')
-        if verbose: print(f' - {width}x{height} - fps: {fps}')
-    return frame_count, width, height, fps
-
-
-def save_frame(frame_path, frame, frame_quality=95):
-    if frame_path.endswith('jpg'):
-        cv2.imwrite(frame_path, frame, [int(cv2.IMWRITE_JPEG_QUALITY), frame_quality])
-    else:
-        cv2.imwrite(frame_path, frame)
-
-
-def clear_terminal_line():
-    sys.stdout.write('\x1b[2K')
-
-
-def start_monitoring_cv2_window(window_name=''):
-    def check_window_is_open():
-        while True:
-            if cv2.getWindowProperty(window_name, 0) >= 0:
-                if not cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE):   # windows is open
-                    print("\nWindow closed")
-                    os._exit(0)
-            time.sleep(0.5)
-
-    thread = threading.Thread(target=check_window_is_open)
-    thread.start()
-
-
-def play_video_frame_idx(video_path=''):
+def play_video_frame_idx(video_path='', cache_mb=512, read_ahead=16, preview='off', preview_width=1280):
     print(f'Opening video: \'{video_path}\'')
+    frame_cache = PreviewFrames(video_path, preview, preview_width, cache_mb, read_ahead)
     total_frames, width, height, fps = count_num_frames_video(video_path, verbose=True)
     delay_frame = int(1000.0/fps)
-    cap = cv2.VideoCapture(video_path)
 
     print(f'    ESC/q: quit    SPACEBAR: pause/play    ←/a: previous frame    →/d: next frame')
     window_name = os.path.basename(video_path)
@@ -86,20 +45,16 @@ def play_video_frame_idx(video_path=''):
     cv2.resizeWindow(window_name, 1024, 680)
     start_monitoring_cv2_window(window_name)
 
-    if not cap.isOpened():
-        Exception(f"Error: Unable to open video file: {video_path}")
-        return
-
     playing = True
     frame_idx = 0
     key = -1
 
-    while cap.isOpened():
+    while True:
         if cv2.getWindowProperty(window_name, cv2.WND_PROP_VISIBLE) >= 1:   # windows is open
             print(f'    {window_name} - frame {frame_idx}/{total_frames} - key: {key}    ', end='\r')
             if playing:
-                ret, frame = cap.read()
-                if not ret:
+                frame = frame_cache.get(frame_idx)
+                if frame is None:
                     print("End of video reached or error reading video")
                     break
                 
@@ -118,17 +73,15 @@ def play_video_frame_idx(video_path=''):
             if key == 81 or key == ord('a'):  # Left arrow key to move backward one frame
                 playing = False
                 frame_idx = max(0, frame_idx-1)
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-                ret, frame = cap.read()
-                if ret:
+                frame = frame_cache.get(frame_idx)
+                if frame is not None:
                     cv2.imshow(window_name, frame)
 
             if key == 83 or key == ord('d'):  # Right arrow key to move forward one frame
                 playing = False
                 frame_idx = min(total_frames-1, frame_idx+1)
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-                ret, frame = cap.read()
-                if ret:
+                frame = frame_cache.get(frame_idx)
+                if frame is not None:
                     cv2.imshow(window_name, frame)
 
             if playing:
@@ -138,9 +91,9 @@ def play_video_frame_idx(video_path=''):
             print("\nWindow closed")
             os._exit(0)
 
-    os._exit(0)
-    cap.release()
+    frame_cache.close()
     cv2.destroyAllWindows()
+    os._exit(0)
 
 
     
@@ -151,7 +104,7 @@ def main():
     if not os.path.exists(args.filepath):
         raise Exception(f'No such file or directory: {args.filepath}')
 
-    play_video_frame_idx(args.filepath)
+    play_video_frame_idx(args.filepath, args.cache_mb, args.read_ahead, args.preview, args.preview_width)
 
     
 